@@ -0,0 +1,177 @@
+import argparse
+import contextlib
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import pandas as pd
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATE_FORMATS = ['%Y-%m-%d', '%Y%m%d', '%d-%m-%Y', '%d%m%Y']
+OUTPUT_FILES = {
+    'orders': 'standardized_columns.csv',
+    'labels': 'merged_labels.csv',
+    'kogan_dispatch': 'koganDispatch.csv',
+    'ebay_dispatch': 'eBayDispatch.csv',
+}
+
+
+def init_worker(reference_dir):
+    """
+    Loads the scripts once per worker process. merge.py reads PhoneModelMSDB.csv and
+    cables.csv from the working folder when it is imported, so that happens from the
+    folder holding the reference data.
+    """
+    os.chdir(reference_dir)
+    global read_and_standardize, write_standardized, merge_orders, run_dispatch
+    from generateLabels import read_and_standardize, write_standardized
+    from merge import merge_orders
+    from dispatch import run_dispatch
+
+
+def find_days(archive_dir):
+    """
+    Every sub folder of the archive with at least one *_orders.csv export, oldest name first.
+    """
+    days = []
+    for entry in sorted(os.scandir(archive_dir), key=lambda e: e.name):
+        if entry.is_dir() and any('_orders.csv' in f.lower() for f in os.listdir(entry.path)):
+            days.append(entry.path)
+    return days
+
+
+def parse_day(name):
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(name, date_format)
+        except ValueError:
+            continue
+    return None
+
+
+def count_rows(path, header=0):
+    if not os.path.exists(path):
+        return 0
+    return len(pd.read_csv(path, dtype=str, header=header, usecols=[0]))
+
+
+def snapshot(output_dir):
+    """
+    Modification time of every output file already in output_dir, to tell them apart from
+    the files the run writes.
+    """
+    stamps = {}
+    for filename in OUTPUT_FILES.values():
+        path = os.path.join(output_dir, filename)
+        if os.path.exists(path):
+            stamps[filename] = os.stat(path).st_mtime_ns
+    return stamps
+
+
+def process_day(day_dir, output_root):
+    """
+    Runs generateLabels, merge and dispatch for one day's exports into output_root/<day>/,
+    keeping the scripts' messages in that folder's backfill.log.
+
+    Returns:
+        dict: Row counts per output file written by this run (files left over from an
+            earlier run count 0), seconds taken and any error.
+    """
+    day = os.path.basename(os.path.normpath(day_dir))
+    output_dir = os.path.join(output_root, day)
+    os.makedirs(output_dir, exist_ok=True)
+    summary = {'day': day, 'status': 'ok', 'seconds': 0.0, **{name: 0 for name in OUTPUT_FILES}}
+    before = snapshot(output_dir)
+
+    started = time.perf_counter()
+    with open(os.path.join(output_dir, 'backfill.log'), 'w') as log, \
+         contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        try:
+            standardized_df = read_and_standardize(day_dir)
+            if standardized_df.empty:
+                summary['status'] = 'no orders'
+            else:
+                standardized_csv = os.path.join(output_dir, OUTPUT_FILES['orders'])
+                write_standardized(standardized_df, standardized_csv)
+                merge_orders(standardized_csv, os.path.join(output_dir, OUTPUT_FILES['labels']))
+                # Dispatch files carry the day they were for, not the day of the back-fill
+                failures = run_dispatch(day_dir, output_dir, dispatch_date=parse_day(day))
+                if failures:
+                    summary['status'] = f"failed: {'; '.join(failures)}"
+        except Exception as e:
+            summary['status'] = f'failed: {e}'
+    summary['seconds'] = round(time.perf_counter() - started, 2)
+
+    after = snapshot(output_dir)
+    for name, filename in OUTPUT_FILES.items():
+        if filename not in after or after[filename] == before.get(filename):
+            continue
+        # eBayDispatch.csv starts with an #INFO line before its header
+        summary[name] = count_rows(os.path.join(output_dir, filename), header=1 if name == 'ebay_dispatch' else 0)
+    return summary
+
+
+def backfill(archive_dir, output_root, workers=None, reference_dir=BASE_DIR):
+    """
+    Processes every day folder of the archive in parallel and writes backfill_summary.csv.
+
+    Returns:
+        pd.DataFrame: One summary row per day, in day order.
+    """
+    days = find_days(archive_dir)
+    if not days:
+        print(f"No day folders with *_orders.csv found in {archive_dir}")
+        return pd.DataFrame()
+
+    output_root = os.path.abspath(output_root)
+    os.makedirs(output_root, exist_ok=True)
+    reference_dir = os.path.abspath(reference_dir)
+
+    summaries = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(reference_dir,)) as executor:
+        futures = {executor.submit(process_day, os.path.abspath(day), output_root): day for day in days}
+        for future in as_completed(futures):
+            summary = future.result()
+            print(f"{summary['day']}: {summary['status']} in {summary['seconds']:.2f}s", flush=True)
+            summaries.append(summary)
+
+    summary_df = pd.DataFrame(summaries).sort_values('day', ignore_index=True)
+    summary_df.to_csv(os.path.join(output_root, 'backfill_summary.csv'), index=False)
+    return summary_df
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Regenerate labels and dispatch files for folders of archived daily exports.")
+    parser.add_argument(
+        "archive",
+        help="Folder with one sub folder of exports per day (eg. 2025-03-01/)"
+    )
+    parser.add_argument(
+        "--out",
+        default="backfill",
+        help="Folder to write each day's outputs to, one sub folder per day (default: backfill)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Days processed at the same time (default: one per CPU)"
+    )
+    parser.add_argument(
+        "--reference-dir",
+        default=BASE_DIR,
+        help="Folder with PhoneModelMSDB.csv and cables.csv (default: the project folder)"
+    )
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    summary_df = backfill(args.archive, args.out, args.workers, args.reference_dir)
+    if summary_df.empty:
+        sys.exit(1)
+
+    print("----------------------------------------------------------------")
+    print(summary_df.to_string(index=False))
+    print(f"{len(summary_df)} days in {time.perf_counter() - started:.2f}s, summary saved to "
+          f"{os.path.join(args.out, 'backfill_summary.csv')}")
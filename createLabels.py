@@ -9,10 +9,21 @@ import os
 import io
 import shutil
 import csv
-from datetime import datetime
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject
 import argparse
 
+from store import open_store, record_sendle_ref
+
 # ======================================================================
 # Warehouse Configuration
 # ======================================================================
@@ -67,25 +78,199 @@ WAREHOUSE_CONFIG = {
 
 SENDLE_ENABLED = False
 CSV_FILENAME = "sendle_batch_csv_template.csv"
-OUTPUT_FILENAME = f"{datetime.now().strftime('%Y%m%d')}_basic.pdf"
 LINE_SPACING = 14
 SAFE_WIDTH = 250
+PDF_PART_PAGES = 200            # pages held in memory before they are flushed to a part file
+LABEL_PAD = 20                  # margin around and inside a basic label
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 SENDLE_DIR = os.path.join(BASE_DIR, "sendles")
-SECRETS_PATH = os.path.join(os.path.dirname(__file__), "secrets.json")
+SECRETS_PATH = os.environ.get("LABELS_SECRETS", os.path.join(os.path.dirname(__file__), "secrets.json"))
+QUOTE_MODEL_PATH = os.path.join(BASE_DIR, "quote_model.json")
+QUOTE_MODEL_MARGIN = 0.5        # dollars either side of the threshold that still get a real quote
+QUOTE_MODEL_MIN_SAMPLES = 3     # quotes a zone needs before it is trusted for a new postcode
+QUOTE_MODEL_MAX_AGE_DAYS = 30   # older prices are ignored, Sendle changes rates
+
+
+def ensure_sendle_dir(sendle_dir=SENDLE_DIR):
+    if not os.path.exists(sendle_dir):
+        os.makedirs(sendle_dir)
+
+
+class LabelRun:
+    """
+    One warehouse's label run: its config, the files it reads and writes, and the Basic and
+    Sendle tracking lists for tracking_update.csv. Runs for several warehouses at once get a
+    suffix on every file (eg. _w1) so they never share outputs.
+    """
+    def __init__(self, warehouse, csv_filename=CSV_FILENAME, suffix="", part_pages=PDF_PART_PAGES, split_pdf=False):
+        today = datetime.now().strftime('%Y%m%d')
+        self.warehouse = warehouse
+        self.config = WAREHOUSE_CONFIG[warehouse]
+        self.csv_filename = csv_filename
+        self.basic_pdf = f"{today}{suffix}_basic.pdf"
+        self.sendle_pdf = f"{today}{suffix}_sendle.pdf"
+        self.basic_csv = f"basic_labels{suffix}.csv"
+        self.tracking_csv = f"tracking_update{suffix}.csv"
+        self.sendle_dir = SENDLE_DIR + suffix
+        self.part_pages = part_pages    # see PdfSpooler
+        self.split_pdf = split_pdf
+        self.sp = [['Basic', ' ', ' ', ' ', ' ']]
+        self.sd = [['Sendle', ' ', ' ', ' ', ' ']]
+
+
+# One connection pool for every Sendle call, shared by all warehouse runs
+SESSION = requests.Session()
+SESSION.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+# Quotes already fetched this session, by (pickup suburb, pickup postcode, delivery suburb, delivery postcode)
+QUOTE_CACHE = {}
+QUOTE_LOCK = threading.Lock()
+
+# ======================================================================
+# Sendle Metrics
+# ======================================================================
 
+VERBOSE = False                 # print every Sendle request and response body
+SENDLE_RETRIES = 2              # extra attempts for quotes and label downloads (never orders)
+SENDLE_RETRY_BACKOFF = 1.0      # seconds, doubled on every retry
+SENDLE_ORDER_WORKERS = 4        # orders being booked at once per run
+SENDLE_DOWNLOAD_WORKERS = 4     # labels being polled for and downloaded at once per run
+LABEL_POLL_INTERVAL = 0.5       # seconds before the first re-poll of a label that is not ready, doubled every poll
+LABEL_POLL_MAX_INTERVAL = 8.0   # longest wait between polls
+LABEL_POLL_TIMEOUT = 120.0      # give up on a label that is still not ready after this many seconds
+LABEL_NOT_READY = {404, 409, 422, 425}  # label url answers while Sendle is still generating the PDF
+METRICS_PATH = "sendle_metrics.json"
+
+
+class SendleMetrics:
+    """
+    Latency, status and throughput counters for every Sendle call, shared by all runs.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)      # endpoint -> seconds per call
+        self.statuses = defaultdict(Counter)    # endpoint -> {"2xx": n, "4xx": n, "5xx": n, "error": n}
+        self.retries = Counter()
+        self.in_flight = 0
+        self.labels_total = 0
+        self.labels_done = 0
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def track(self, endpoint):
+        with self.lock:
+            self.in_flight += 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+                self.latencies[endpoint].append(time.perf_counter() - started)
+
+    def record(self, endpoint, status_code=None):
+        status = "error" if status_code is None else f"{status_code // 100}xx"
+        with self.lock:
+            self.statuses[endpoint][status] += 1
+
+    def retry(self, endpoint):
+        with self.lock:
+            self.retries[endpoint] += 1
+
+    def add_labels(self, count):
+        with self.lock:
+            if not self.labels_total:
+                self.started = time.perf_counter()  # throughput counts from the first run, not import
+            self.labels_total += count
+
+    def label_done(self):
+        with self.lock:
+            self.labels_done += 1
+
+    def percentiles(self, endpoint):
+        latencies = self.latencies.get(endpoint)
+        if not latencies:
+            return {}
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+        return {"p50_ms": round(p50, 1), "p95_ms": round(p95, 1), "p99_ms": round(p99, 1)}
+
+    def rate(self):
+        elapsed = time.perf_counter() - self.started
+        per_second = self.labels_done / elapsed if elapsed > 0 else 0.0
+        remaining = self.labels_total - self.labels_done
+        eta = remaining / per_second if per_second > 0 else None
+        return per_second, eta
+
+    def progress_line(self):
+        with self.lock:
+            per_second, eta = self.rate()
+            parts = [f"[{self.labels_done}/{self.labels_total}] {per_second:.1f} labels/s",
+                     f"ETA {eta:.0f}s" if eta is not None else "ETA -"]
+            for endpoint in sorted(self.latencies):
+                p = self.percentiles(endpoint)
+                parts.append(f"{endpoint} p50 {p['p50_ms']:.0f}ms p95 {p['p95_ms']:.0f}ms")
+            errors = Counter()
+            for counts in self.statuses.values():
+                errors.update(counts)
+            parts.append(f"in-flight {self.in_flight} | 4xx {errors['4xx']} 5xx {errors['5xx']} "
+                         f"err {errors['error']} retries {sum(self.retries.values())}")
+            return " | ".join(parts)
+
+    def summary(self):
+        with self.lock:
+            per_second, _ = self.rate()
+            return {
+                "labels": self.labels_done,
+                "seconds": round(time.perf_counter() - self.started, 2),
+                "labels_per_second": round(per_second, 3),
+                "endpoints": {
+                    endpoint: {
+                        "calls": len(self.latencies[endpoint]),
+                        **self.percentiles(endpoint),
+                        "statuses": dict(self.statuses[endpoint]),
+                        "retries": self.retries[endpoint],
+                    }
+                    for endpoint in sorted(self.latencies)
+                },
+            }
 
-def ensure_sendle_dir():
-    if not os.path.exists(SENDLE_DIR):
-        os.makedirs(SENDLE_DIR)
+    def show_progress(self, final=False):
+        # One line redrawn in place on a terminal, an occasional line in logs
+        if sys.stdout.isatty():
+            print("\r" + self.progress_line(), end="\n" if final else "", flush=True)
+        elif final or self.labels_done % 25 == 0:
+            print(self.progress_line(), flush=True)
 
+    def dump(self, path=METRICS_PATH):
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
 
-# empty default until CLI loads
-SENDER_INFO = [" ", " ", " ", " ", " "]
 
-# Tracking
-sp = [['Basic', ' ', ' ', ' ', ' ']]
-sd = [['Sendle', ' ', ' ', ' ', ' ']]
+METRICS = SendleMetrics()
+
+
+def sendle_request(endpoint, method, url, retries=0, **kwargs):
+    """
+    Sends one Sendle request through the shared session, timing it and counting its status.
+    Timeouts, 429s and 5xx answers are retried up to `retries` times with backoff, so only
+    pass retries for calls that are safe to repeat.
+    """
+    for attempt in range(retries + 1):
+        if attempt:
+            METRICS.retry(endpoint)
+            time.sleep(SENDLE_RETRY_BACKOFF * 2 ** (attempt - 1))
+        try:
+            with METRICS.track(endpoint):
+                response = SESSION.request(method, url, **kwargs)
+        except requests.RequestException:
+            METRICS.record(endpoint)
+            if attempt == retries:
+                raise
+            continue
+
+        METRICS.record(endpoint, response.status_code)
+        if attempt == retries or (response.status_code < 500 and response.status_code != 429):
+            return response
 
 # ======================================================================
 # Load API Keys
@@ -128,10 +313,106 @@ def get_sendle_quote(pickup_suburb, pickup_postcode, delivery_suburb, delivery_p
     auth = base64.b64encode(f"{SENDLE_ID}:{API_KEY}".encode()).decode()
     headers = {"Authorization": f"Basic {auth}", "Content-Type": "application/json"}
 
-    response = requests.get(SENDLE_API_QUOTE_URL, params=payload, headers=headers)
+    response = sendle_request("quote", "GET", SENDLE_API_QUOTE_URL, retries=SENDLE_RETRIES, params=payload, headers=headers)
     return response.json()
 
 
+# ======================================================================
+# Quote Price Model
+# ======================================================================
+
+def load_quote_model(path=QUOTE_MODEL_PATH):
+    """
+    Past quotes as {pickup postcode: {delivery postcode or zone: {"min", "max", "n", "updated"}}}.
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_quote_model(model, path=QUOTE_MODEL_PATH):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(model, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def quote_zone(postcode):
+    # Postcodes sharing their first two digits are close enough to price alike
+    return "zone:" + str(postcode).strip().zfill(4)[:2]
+
+
+def record_quote(model, pickup_postcode, delivery_postcode, price):
+    today = datetime.now().strftime("%Y-%m-%d")
+    prices = model.setdefault(str(pickup_postcode), {})
+    for key in (str(delivery_postcode).strip(), quote_zone(delivery_postcode)):
+        stats = prices.get(key)
+        if stats is None or stats["updated"] < stale_cutoff():
+            stats = prices[key] = {"min": price, "max": price, "n": 0}
+        stats["min"] = min(stats["min"], price)
+        stats["max"] = max(stats["max"], price)
+        stats["n"] += 1
+        stats["updated"] = today
+
+
+def stale_cutoff():
+    return (datetime.now() - timedelta(days=QUOTE_MODEL_MAX_AGE_DAYS)).strftime("%Y-%m-%d")
+
+
+def classify_quote(model, pickup_postcode, delivery_postcode, price_threshold):
+    """
+    Decides from past quotes whether a destination is "above" or "below" the threshold.
+    The postcode's own quotes are used first, then its zone's; anything close to the
+    threshold, stale or seen too rarely is "uncertain" and gets a real quote.
+    """
+    prices = model.get(str(pickup_postcode), {})
+    for key, min_samples in ((str(delivery_postcode).strip(), 1), (quote_zone(delivery_postcode), QUOTE_MODEL_MIN_SAMPLES)):
+        stats = prices.get(key)
+        if stats is None or stats["n"] < min_samples or stats["updated"] < stale_cutoff():
+            continue
+        if stats["min"] >= price_threshold + QUOTE_MODEL_MARGIN:
+            return "above"
+        if stats["max"] < price_threshold - QUOTE_MODEL_MARGIN:
+            return "below"
+        return "uncertain"
+    return "uncertain"
+
+
+def quote_price_for(row, config):
+    """
+    Gross Sendle quote for the row (999 when there is none), fetched once per destination
+    and pickup for the whole session.
+    """
+    key = (config["quote_pickup_suburb"], config["quote_pickup_postcode"], row["receiver_suburb"], str(row["receiver_postcode"]))
+    with QUOTE_LOCK:
+        if key in QUOTE_CACHE:
+            return QUOTE_CACHE[key]
+
+    quote_response = get_sendle_quote(
+        pickup_suburb=config["quote_pickup_suburb"],
+        pickup_postcode=config["quote_pickup_postcode"],
+        delivery_suburb=row["receiver_suburb"],
+        delivery_postcode=row["receiver_postcode"],
+        weight=0.2,
+        length=10,
+        width=10,
+        height=10
+    )
+
+    try:
+        if isinstance(quote_response, list) and quote_response:
+            quote_price = float(quote_response[0].get("quote", {}).get("gross", {}).get("amount", 999))
+        else:
+            quote_price = float(quote_response.get("quote", {}).get("gross", {}).get("amount", 999))
+    except Exception:
+        quote_price = 999
+
+    with QUOTE_LOCK:
+        QUOTE_CACHE[key] = quote_price
+    return quote_price
+
+
 def create_sendle_order(row, config):
     order_payload = {
         "pickup_option": "drop_off",
@@ -171,16 +452,19 @@ def create_sendle_order(row, config):
 
     auth = base64.b64encode(f"{SENDLE_ID}:{API_KEY}".encode()).decode()
     headers = {"Authorization": f"Basic {auth}", "Content-Type": "application/json"}
-    response = requests.post(SENDLE_API_ORDER_URL, json=order_payload, headers=headers)
+    response = sendle_request("order", "POST", SENDLE_API_ORDER_URL, json=order_payload, headers=headers)
 
-    print("\t[*] Order request:", order_payload)
-    print("\t[*] Order response:", response.status_code, response.text)
+    if VERBOSE:
+        print("\t[*] Order request:", order_payload)
+        print("\t[*] Order response:", response.status_code, response.text)
+    elif response.status_code >= 400:
+        print(f"\t[*] Order for {row['customer_reference']} failed: {response.status_code} {response.text[:300]}")
 
     return response.json()
 
 
 def extract_label_url(order_response, preferred_size="a4"):
-    labels = order_response.get("labels", [])
+    labels = order_response.get("labels") or []
     if isinstance(labels, list) and labels:
         for lbl in labels:
             if lbl.get("format") == "pdf" and lbl.get("size") == preferred_size:
@@ -189,15 +473,63 @@ def extract_label_url(order_response, preferred_size="a4"):
     return None
 
 
-def download_sendle_label(label_url, order_ref):
-    ensure_sendle_dir()
-    filename = os.path.join(SENDLE_DIR, f"{order_ref}.pdf")
+def poll_delays(timeout=LABEL_POLL_TIMEOUT):
+    """
+    Seconds to wait before each re-poll of a label: LABEL_POLL_INTERVAL, doubling up to
+    LABEL_POLL_MAX_INTERVAL, until timeout seconds have passed.
+    """
+    deadline = time.monotonic() + timeout
+    delay = LABEL_POLL_INTERVAL
+    while time.monotonic() + delay < deadline:
+        yield delay
+        delay = min(delay * 2, LABEL_POLL_MAX_INTERVAL)
+
+
+def wait_for_label_url(order_url):
+    """
+    Polls a booked order until Sendle has attached its labels, for orders that came back
+    without them. Returns the label url, or None if it never showed up.
+    """
+    auth = base64.b64encode(f"{SENDLE_ID}:{API_KEY}".encode()).decode()
+    headers = {"Authorization": f"Basic {auth}", "Accept": "application/json"}
+
+    delays = poll_delays()
+    while True:
+        try:
+            response = sendle_request("order status", "GET", order_url, retries=SENDLE_RETRIES, headers=headers, timeout=30)
+            if response.status_code == 200:
+                label_url = extract_label_url(response.json())
+                if label_url:
+                    return label_url
+        except (requests.RequestException, ValueError) as e:
+            print(f"Could not check order {order_url}: {e}")
+
+        delay = next(delays, None)
+        if delay is None:
+            return None
+        METRICS.retry("order status")
+        time.sleep(delay)
+
+
+def download_sendle_label(label_url, order_ref, sendle_dir=SENDLE_DIR):
+    ensure_sendle_dir(sendle_dir)
+    filename = os.path.join(sendle_dir, f"{order_ref}.pdf")
 
     auth = base64.b64encode(f"{SENDLE_ID}:{API_KEY}".encode()).decode()
     headers = {"Authorization": f"Basic {auth}", "Accept": "application/pdf"}
 
     try:
-        response = requests.get(label_url, headers=headers, stream=True, timeout=30)
+        # A freshly booked label can take a moment to render, poll until it is ready
+        delays = poll_delays()
+        while True:
+            response = sendle_request("label", "GET", label_url, retries=SENDLE_RETRIES, headers=headers, stream=True, timeout=30)
+            delay = next(delays, None) if response.status_code in LABEL_NOT_READY else None
+            if delay is None:
+                break
+            response.close()
+            METRICS.retry("label")
+            time.sleep(delay)
+
         if response.status_code != 200:
             print(f"Failed to download label for {order_ref}: {response.status_code}")
             snippet = (response.text[:300] + '...') if response.text else "no response body"
@@ -209,7 +541,8 @@ def download_sendle_label(label_url, order_ref):
                 if chunk:
                     f.write(chunk)
 
-        print(f"Downloaded Sendle label → {filename}")
+        if VERBOSE:
+            print(f"Downloaded Sendle label → {filename}")
         return filename
 
     except requests.RequestException as e:
@@ -217,36 +550,262 @@ def download_sendle_label(label_url, order_ref):
         return None
 
 
-def combine_sendle_pdfs(output_filename):
-    if not os.path.exists(SENDLE_DIR):
+def combine_sendle_pdfs(output_filename, sendle_dir=SENDLE_DIR, part_pages=PDF_PART_PAGES, split=False):
+    """
+    Joins the downloaded Sendle labels into output_filename (or its _partN.pdf files with split).
+
+    Returns:
+        bool: True when every label made it in, so the downloads can be cleared.
+    """
+    if not os.path.exists(sendle_dir):
         print("No Sendle labels found.")
-        return
+        return True
 
     sendle_pdfs = sorted(
-        [os.path.join(SENDLE_DIR, f) for f in os.listdir(SENDLE_DIR) if f.endswith(".pdf")]
+        [os.path.join(sendle_dir, f) for f in os.listdir(sendle_dir) if f.endswith(".pdf")]
     )
 
     if not sendle_pdfs:
         print("No Sendle labels found.")
-        return
+        return True
 
-    writer = PdfWriter()
+    spooler = PdfSpooler(output_filename, part_pages, split)
     for path in sendle_pdfs:
-        with open(path, "rb") as f:
-            reader = PdfReader(f)
-            for page in reader.pages:
-                writer.add_page(page)
+        spooler.add_pdf(path)
+    written = spooler.close()
+
+    print(f"Combined {len(sendle_pdfs) - len(spooler.failed_sources)} Sendle labels into {', '.join(written) or 'nothing'}")
+    spooler.report()
+    return not spooler.failed
+
+
+def clear_sendle_dir(sendle_dir=SENDLE_DIR):
+    if os.path.exists(sendle_dir):
+        shutil.rmtree(sendle_dir)
+        print(f"Cleared {os.path.basename(sendle_dir)}/ directory.")
+
 
-    with open(output_filename, "wb") as f:
-        writer.write(f)
+# ======================================================================
+# PDF Spooling
+# ======================================================================
 
-    print(f"Combined {len(sendle_pdfs)} Sendle labels into {output_filename}")
+class PdfJoiner:
+    """
+    Concatenates PDF files into one, writing each file's pages and the objects they use
+    straight to the output and letting go of the file before the next one is read, so
+    memory stays at one input file however long the output gets. (PyPDF2's PdfWriter and
+    PdfMerger keep every page in memory until the very end.)
+
+    Objects are copied as they are with new numbers; the pages are hung under one new page
+    tree, object 2, with the catalog as object 1.
+    """
+    def __init__(self, output_filename):
+        self.out = open(output_filename, "wb")
+        self.out.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        self.offsets = [None, None]     # file offset of every object, by number - 1
+        self.kids = []
+
+    def new_number(self):
+        self.offsets.append(None)
+        return len(self.offsets)
+
+    def add_pdf(self, path):
+        reader = PdfReader(path)
+        numbers = {}                    # (idnum, generation) in the file -> number in the output
+        pending = []
+
+        def number_of(ref):
+            key = (ref.idnum, ref.generation)
+            if key not in numbers:
+                numbers[key] = self.new_number()
+                pending.append(ref)
+            return numbers[key]
+
+        # Page tree nodes become the new page tree, pages keep their (inherited) attributes
+        nodes = [reader.trailer["/Root"].raw_get("/Pages")]
+        while nodes:
+            node = nodes.pop()
+            numbers[(node.idnum, node.generation)] = 2
+            for kid in node.get_object().get("/Kids", ArrayObject()):
+                if kid.get_object().get("/Type") == "/Pages":
+                    nodes.append(kid)
+        pages = [(page, number_of(page.indirect_reference)) for page in reader.pages]
+        pending.clear()
+
+        for page, number in pages:
+            self.kids.append(number)
+            self.write_object(number, page, number_of, skip=("/Parent",), extra=b"/Parent 2 0 R\n")
+            while pending:
+                ref = pending.pop()
+                self.write_object(numbers[(ref.idnum, ref.generation)], ref.get_object(), number_of)
+        return len(pages)
+
+    def write_object(self, number, obj, number_of, skip=(), extra=b""):
+        self.offsets[number - 1] = self.out.tell()
+        self.out.write(f"{number} 0 obj\n".encode())
+        self.write_value(obj, number_of, skip, extra)
+        self.out.write(b"\nendobj\n")
+
+    def write_value(self, obj, number_of, skip=(), extra=b""):
+        out = self.out
+        if isinstance(obj, IndirectObject):
+            out.write(f"{number_of(obj)} 0 R".encode())
+        elif isinstance(obj, DictionaryObject):
+            data = obj._data if isinstance(obj, StreamObject) else None
+            out.write(b"<<\n" + extra)
+            for key, value in obj.items():
+                if key in skip or (data is not None and key == "/Length"):
+                    continue
+                key.write_to_stream(out, None)
+                out.write(b" ")
+                self.write_value(value, number_of)
+                out.write(b"\n")
+            if data is not None:
+                out.write(f"/Length {len(data)}\n>>\nstream\n".encode())
+                out.write(data)
+                out.write(b"\nendstream")
+            else:
+                out.write(b">>")
+        elif isinstance(obj, ArrayObject):
+            out.write(b"[")
+            for value in obj:
+                out.write(b" ")
+                self.write_value(value, number_of)
+            out.write(b" ]")
+        else:
+            obj.write_to_stream(out, None)
+
+    def close(self):
+        self.offsets[1] = self.out.tell()
+        kids = " ".join(f"{number} 0 R" for number in self.kids)
+        self.out.write(f"2 0 obj\n<< /Type /Pages /Kids [ {kids} ] /Count {len(self.kids)} >>\nendobj\n".encode())
+        self.offsets[0] = self.out.tell()
+        self.out.write(b"1 0 obj\n<< /Type /Catalog /Pages 2 0 R >>\nendobj\n")
+
+        xref = self.out.tell()
+        self.out.write(f"xref\n0 {len(self.offsets) + 1}\n0000000000 65535 f \n".encode())
+        self.out.write("".join(f"{offset or 0:010d} 00000 n \n" for offset in self.offsets).encode())
+        self.out.write(f"trailer\n<< /Size {len(self.offsets) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+        self.out.close()
+
+
+class PdfSpooler:
+    """
+    Writes a long PDF part_pages pages at a time, so only one part is ever held in memory.
+
+    With split the parts are the output: name_part1.pdf, name_part2.pdf, ... appear on disk
+    as they fill up. Otherwise the parts go to a temporary folder next to the output and
+    close() streams them into output_filename one part at a time with PdfJoiner.
+
+    Files and pages that cannot be read are skipped and listed in failed, instead of
+    losing the whole document.
+    """
+    def __init__(self, output_filename, part_pages=PDF_PART_PAGES, split=False):
+        self.output_filename = output_filename
+        self.part_pages = max(1, part_pages)
+        self.split = split
+        self.spool_dir = None
+        self.parts = []
+        self.writer = PdfWriter()
+        self.readers = []       # sources of the pages in self.writer, see add_pdf
+        self.pending = 0        # pages in self.writer
+        self.total = 0
+        self.failed = []
+        self.failed_sources = set()
+
+    def part_path(self, number):
+        if self.split:
+            stem, ext = os.path.splitext(self.output_filename)
+            return f"{stem}_part{number}{ext or '.pdf'}"
+        if self.spool_dir is None:
+            output_dir = os.path.dirname(os.path.abspath(self.output_filename))
+            self.spool_dir = tempfile.mkdtemp(prefix="pdf_parts_", dir=output_dir)
+        return os.path.join(self.spool_dir, f"part{number:05d}.pdf")
+
+    def flush(self):
+        if not self.pending:
+            return
+        path = self.part_path(len(self.parts) + 1)
+        with open(path, "wb") as f:
+            self.writer.write(f)
+        self.parts.append(path)
+        self.writer = PdfWriter()
+        self.readers = []
+        self.pending = 0
+
+    def next_part(self, pages):
+        """
+        Path for a part the caller writes itself (eg. a reportlab canvas), holding pages pages.
+        """
+        self.flush()
+        path = self.part_path(len(self.parts) + 1)
+        self.parts.append(path)
+        self.total += pages
+        return path
+
+    def add_page(self, page):
+        self.writer.add_page(page)
+        self.pending += 1
+        self.total += 1
+        if self.pending >= self.part_pages:
+            self.flush()
+
+    def add_pdf(self, source, name=None):
+        """
+        Adds every readable page of a PDF file (or file-like object).
+
+        Returns:
+            int: The number of pages added.
+        """
+        name = name or os.path.basename(str(source))
+        # PyPDF2 raises all sorts of errors on damaged files, none of them should stop the batch
+        try:
+            reader = PdfReader(source)
+            pages = list(reader.pages)
+        except Exception as e:
+            self.failed.append(f"{name}: {e}")
+            self.failed_sources.add(name)
+            return 0
+
+        # PyPDF2 tells sources apart by id(), a reader freed before the writer is written can
+        # have its id reused by the next file and get that file's pages swapped for its own
+        self.readers.append(reader)
+        added = 0
+        for number, page in enumerate(pages, 1):
+            try:
+                self.add_page(page)
+                added += 1
+            except Exception as e:
+                self.failed.append(f"{name} page {number}: {e}")
+                self.failed_sources.add(name)
+        return added
+
+    def close(self):
+        """
+        Writes out the last part and, without split, joins the parts into output_filename.
+
+        Returns:
+            list: The files written, empty when there were no pages.
+        """
+        self.flush()
+        if self.split or not self.parts:
+            return list(self.parts)
 
+        try:
+            if len(self.parts) == 1:
+                shutil.move(self.parts[0], self.output_filename)
+            else:
+                joiner = PdfJoiner(self.output_filename)
+                for path in self.parts:
+                    joiner.add_pdf(path)
+                joiner.close()
+        finally:
+            shutil.rmtree(self.spool_dir, ignore_errors=True)
+        return [self.output_filename]
 
-def clear_sendle_dir():
-    if os.path.exists(SENDLE_DIR):
-        shutil.rmtree(SENDLE_DIR)
-        print("Cleared sendles/ directory.")
+    def report(self):
+        for failure in self.failed:
+            print(f"\t[!] Skipped {failure}")
 
 
 # ======================================================================
@@ -271,15 +830,48 @@ def draw_wrapped_reference(c, text, x, y, font="Helvetica", size=12, max_width=S
     return y
 
 
-def draw_label(c, data, sender_info=None):
+def parse_grid(text):
+    """
+    "2x2" -> (2, 2): columns and rows of A6 labels per A4 page.
+    """
+    try:
+        columns, rows = (int(n) for n in text.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"grid must look like 2x2, got {text!r}")
+
     page_w, page_h = A4
     label_w, label_h = A6
+    # A6 is exactly a quarter of A4, allow for the rounding in the page sizes
+    if columns < 1 or rows < 1 or page_w / columns < label_w - 1 or page_h / rows < label_h - 1:
+        raise argparse.ArgumentTypeError(f"{columns}x{rows} A6 labels do not fit on an A4 page")
+    return columns, rows
 
-    PAD = 20
 
-    # Position A6 inside A4
-    origin_x = PAD
-    origin_y = page_h - label_h - PAD
+def label_origins(grid=(1, 1)):
+    """
+    Bottom-left corner of every label slot on a page, filled left to right, top to bottom.
+    A single label keeps its original spot in the top-left corner, LABEL_PAD in from the edges.
+    """
+    page_w, page_h = A4
+    columns, rows = grid
+    if grid == (1, 1):
+        return [(LABEL_PAD, page_h - A6[1] - LABEL_PAD)]
+
+    cell_w = page_w / columns
+    cell_h = page_h / rows
+    return [(col * cell_w, page_h - (row + 1) * cell_h) for row in range(rows) for col in range(columns)]
+
+
+def draw_label(c, data, sender_info=None, origin=None):
+    page_w, page_h = A4
+    label_w, label_h = A6
+
+    PAD = LABEL_PAD
+
+    # Position A6 inside A4, by default the single label spot
+    if origin is None:
+        origin = label_origins()[0]
+    origin_x, origin_y = origin
 
     def L(x, y):
         return origin_x + x, origin_y + y
@@ -358,8 +950,63 @@ def draw_label(c, data, sender_info=None):
 # Main Processing
 # ======================================================================
 
-def generate_labels(csv_filename, output_filename, config, price_threshold=6.0):
-    df = pd.read_csv(csv_filename)
+def finish_label():
+    METRICS.label_done()
+    if not VERBOSE:
+        METRICS.show_progress()
+
+
+def is_booked(order_response):
+    """
+    Whether Sendle made (and charged for) the order, whether or not its label is ready yet.
+    """
+    return bool(order_response.get("sendle_reference") or order_response.get("order_url"))
+
+
+def fetch_sendle_label(order_response, sendle_ref, sendle_dir):
+    """
+    Download stage: waits for the booked order's label to be ready and saves it.
+
+    Returns:
+        str: The label url, or None when the order was not booked or never got a label.
+    """
+    try:
+        if not is_booked(order_response):
+            return None
+        label_url = extract_label_url(order_response)
+        if not label_url and order_response.get("order_url"):
+            label_url = wait_for_label_url(order_response["order_url"])
+        if label_url:
+            download_sendle_label(label_url, sendle_ref, sendle_dir)
+        return label_url
+    finally:
+        finish_label()
+
+
+def book_sendle_order(row, config, sendle_dir, download_pool):
+    """
+    Order stage: books the Sendle order and hands its label to the download stage
+    without waiting for it, so the next order can be booked straight away.
+
+    Returns:
+        tuple: (sendle reference, tracking url, whether the order was booked, future of fetch_sendle_label)
+    """
+    order_response = create_sendle_order(row, config)
+    sendle_ref = order_response.get("sendle_reference", row["customer_reference"])
+    download = download_pool.submit(fetch_sendle_label, order_response, sendle_ref, sendle_dir)
+    return sendle_ref, order_response.get("tracking_url"), is_booked(order_response), download
+
+
+def create_sendle_labels(run, price_threshold=6.0, store=None, quote_model=None):
+    """
+    Quotes every row of the run's CSV and books Sendle orders for the ones under the price
+    threshold, downloading their labels into the run's sendles folder. Rows that need a basic
+    label are written to the run's basic_labels.csv, and both lists to its tracking_update.csv.
+    With a quote_model (see load_quote_model) only destinations it is unsure about are
+    quoted, and the new quotes are added to it.
+    """
+    config = run.config
+    df = pd.read_csv(run.csv_filename)
 
     required_cols = [
         "receiver_name",
@@ -372,64 +1019,166 @@ def generate_labels(csv_filename, output_filename, config, price_threshold=6.0):
     ]
 
     df = df[required_cols]
-    c = canvas.Canvas(output_filename, pagesize=A4)
-
-    for _, row in df.iterrows():
-        quote_response = get_sendle_quote(
-            pickup_suburb=config["quote_pickup_suburb"],
-            pickup_postcode=config["quote_pickup_postcode"],
-            delivery_suburb=row["receiver_suburb"],
-            delivery_postcode=row["receiver_postcode"],
-            weight=0.2,
-            length=10,
-            width=10,
-            height=10
-        )
-
-        try:
-            if isinstance(quote_response, list) and quote_response:
-                quote_price = float(quote_response[0].get("quote", {}).get("gross", {}).get("amount", 999))
+    basic_rows = []
+    METRICS.add_labels(len(df))
+
+    # Rows are quoted here one after the other. Cheap ones are booked by the order pool,
+    # which passes each booked order on to the download pool, so quoting, booking and
+    # downloading overlap. The pools are sized separately to keep within Sendle's limits.
+    bookings = []
+    with ThreadPoolExecutor(max_workers=SENDLE_DOWNLOAD_WORKERS) as download_pool, \
+         ThreadPoolExecutor(max_workers=SENDLE_ORDER_WORKERS) as order_pool:
+        for _, row in df.iterrows():
+            known = "uncertain"
+            if quote_model is not None:
+                with QUOTE_LOCK:
+                    known = classify_quote(quote_model, config["quote_pickup_postcode"], row["receiver_postcode"], price_threshold)
+
+            if known != "uncertain":
+                # Past quotes to this destination settle it, no need to ask Sendle again
+                quote_price = 0 if known == "below" else 999
+                if VERBOSE:
+                    print(f"Quote for {row['receiver_name']}: skipped, {row['receiver_postcode']} is always {known} ${price_threshold:.2f}")
             else:
-                quote_price = float(quote_response.get("quote", {}).get("gross", {}).get("amount", 999))
-        except Exception:
-            quote_price = 999
+                quote_price = quote_price_for(row, config)
+                if VERBOSE:
+                    print(f"Quote for {row['receiver_name']}: ${quote_price:.2f}")
 
-        print(f"Quote for {row['receiver_name']}: ${quote_price:.2f}")
+                if quote_model is not None and SENDLE_ENABLED and quote_price != 999:
+                    with QUOTE_LOCK:
+                        record_quote(quote_model, config["quote_pickup_postcode"], row["receiver_postcode"], quote_price)
 
+            if quote_price < price_threshold:
+                bookings.append((row, order_pool.submit(book_sendle_order, row, config, run.sendle_dir, download_pool)))
+            else:
+                bookings.append((row, None))
+                finish_label()
+
+    # Every order and download has finished, collect them in the CSV's order
+    missing_labels = []
+    for row, booking in bookings:
         order_id = row["description"]
         receiver = row["receiver_name"]
 
-        label_url = ""
-        tracking_url = ""
-        sendle_ref = ""
-
-        if quote_price < price_threshold:
-            order_response = create_sendle_order(row, config)
-            tracking_url = order_response.get("tracking_url")
-            label_url = extract_label_url(order_response)
-            sendle_ref = order_response.get("sendle_reference", row["customer_reference"])
-
-        if label_url:
-            download_sendle_label(label_url, sendle_ref)
-            sd.append([order_id, ' ', ' ', receiver, sendle_ref, ' ', ' ', tracking_url])
+        booked = False
+        if booking is not None:
+            # One failed order must not cost the tracking of the orders booked around it
+            try:
+                sendle_ref, tracking_url, booked, download = booking.result()
+            except Exception as e:
+                print(f"\t[!] Sendle order for {order_id} failed, using a basic label: {e}")
+                finish_label()
+            else:
+                # A booked order is paid for, so it keeps its tracking even without a label;
+                # the label can still be reprinted from Sendle
+                try:
+                    label_url = download.result()
+                except Exception as e:
+                    label_url = None
+                    print(f"\t[!] Sendle label {sendle_ref} for {order_id} could not be downloaded: {e}")
+                if booked and not label_url:
+                    missing_labels.append(f"{sendle_ref} ({order_id})")
+
+        if booked:
+            run.sd.append([order_id, ' ', ' ', receiver, sendle_ref, ' ', ' ', tracking_url])
+            if store is not None:
+                record_sendle_ref(store, order_id, sendle_ref, tracking_url)
         else:
-            draw_label(c, row, SENDER_INFO)
-            sp.append([order_id, ' ', ' ', receiver, ' '])
-            c.showPage()
+            basic_rows.append(row)
+            run.sp.append([order_id, ' ', ' ', receiver, ' '])
 
-    c.save()
-    print(f"Basic Parcel PDF created: {output_filename}")
+    if missing_labels:
+        print(f"\t[!] {len(missing_labels)} booked Sendle label(s) are missing from {run.sendle_dir}, reprint them from Sendle:")
+        for missing in missing_labels:
+            print(f"\t\t{missing}")
 
-    sendle_output = f"{datetime.now().strftime('%Y%m%d')}_sendle.pdf"
-    combine_sendle_pdfs(sendle_output)
-    print(f"Sendle labels PDF created: {sendle_output}")
-    clear_sendle_dir()
+    if quote_model is not None and SENDLE_ENABLED:
+        with QUOTE_LOCK:
+            save_quote_model(quote_model)
 
-    with open('tracking_update.csv', 'w', newline='') as csvfile:
+    pd.DataFrame(basic_rows, columns=required_cols).to_csv(run.basic_csv, index=False)
+
+    with open(run.tracking_csv, 'w', newline='') as csvfile:
         writer = csv.writer(csvfile)
-        writer.writerows(sp)
+        writer.writerows(run.sp)
         writer.writerow([])
-        writer.writerows(sd)
+        writer.writerows(run.sd)
+
+
+def draw_basic_labels(run, grid=(1, 1)):
+    """
+    Draws a basic label for every row of the run's basic_labels.csv, grid[0] x grid[1]
+    labels to a page in the order of the file. Every run.part_pages pages go to their own
+    canvas and PdfSpooler part, so a canvas never holds the whole day.
+    """
+    df = pd.read_csv(run.basic_csv)
+    slots = label_origins(grid)
+    spooler = PdfSpooler(run.basic_pdf, run.part_pages, run.split_pdf)
+    skipped = 0
+
+    rows_per_part = run.part_pages * len(slots)
+    for start in range(0, len(df), rows_per_part):
+        part = df.iloc[start:start + rows_per_part]
+        c = canvas.Canvas(spooler.next_part(-(-len(part) // len(slots))), pagesize=A4)
+        for i, (_, row) in enumerate(part.iterrows()):
+            slot = i % len(slots)
+            if slot == 0 and i:
+                c.showPage()
+            try:
+                draw_label(c, row, run.config["label_sender_block"], origin=slots[slot])
+            except Exception as e:
+                # Anything drawn before the error stays on the page, flag it for a reprint
+                print(f"\t[!] Basic label for {row.get('description', start + i)} could not be drawn: {e}")
+                skipped += 1
+        c.showPage()
+        c.save()
+
+    written = spooler.close()
+    if not written:
+        # Same empty document as before, so later steps still find the file
+        canvas.Canvas(run.basic_pdf, pagesize=A4).save()
+        written = [run.basic_pdf]
+    spooler.report()
+    print(f"Basic Parcel PDF created: {', '.join(written)}" + (f" ({skipped} labels need a reprint)" if skipped else ""))
+
+
+def combine_sendle_labels(run):
+    complete = combine_sendle_pdfs(run.sendle_pdf, run.sendle_dir, run.part_pages, run.split_pdf)
+    if complete:
+        clear_sendle_dir(run.sendle_dir)
+    else:
+        print(f"Kept {os.path.basename(run.sendle_dir)}/ as some labels could not be read.")
+
+
+def generate_labels(run, price_threshold=6.0, store=None, quote_model=None, grid=(1, 1), render_pool=None):
+    """
+    Books the run's Sendle labels, then draws the basic PDF and combines the Sendle PDF,
+    side by side when a render_pool is given.
+    """
+    create_sendle_labels(run, price_threshold, store, quote_model)
+    if render_pool is None:
+        draw_basic_labels(run, grid)
+        combine_sendle_labels(run)
+    else:
+        renders = [render_pool.submit(draw_basic_labels, run, grid), render_pool.submit(combine_sendle_labels, run)]
+        for render in renders:
+            render.result()
+
+
+def generate_labels_for_warehouses(runs, price_threshold=6.0, store_path=None, quote_model=None, grid=(1, 1)):
+    """
+    Runs several warehouses at once in this process. They share the HTTP connection pool,
+    the session's quotes and quote model, and one pool of PDF rendering threads.
+    """
+    def run_one(run):
+        # sqlite connections cannot cross threads, every run opens its own
+        store = open_store(store_path) if store_path else None
+        generate_labels(run, price_threshold, store, quote_model, grid, render_pool)
+
+    with ThreadPoolExecutor(max_workers=2 * len(runs)) as render_pool, \
+         ThreadPoolExecutor(max_workers=len(runs)) as warehouse_pool:
+        for run, _ in zip(runs, warehouse_pool.map(run_one, runs)):
+            print(f"Warehouse {run.warehouse} done: {run.basic_pdf}, {run.sendle_pdf}, {run.tracking_csv}")
 
 
 # ======================================================================
@@ -441,8 +1190,16 @@ if __name__ == "__main__":
     parser.add_argument(
         "--warehouse",
         required=True,
+        nargs="+",
         choices=["1", "2"],
-        help="Select which warehouse's sender information to use. 1 = Pakenham 2 = Carnegie "
+        help="Select which warehouse's sender information to use. 1 = Pakenham 2 = Carnegie. "
+             "Several warehouses run side by side, each with its own --csv"
+    )
+    parser.add_argument(
+        "--csv",
+        nargs="+",
+        default=None,
+        help=f"Input CSV for each --warehouse, in the same order (default: {CSV_FILENAME} for a single warehouse)"
     )
     parser.add_argument(
         "--threshold",
@@ -450,10 +1207,78 @@ if __name__ == "__main__":
         default=7.0,
         help="Maximum Sendle quote price before falling back to basic label (default: 6.0)"
     )
+    parser.add_argument(
+        "--no-quote-model",
+        action="store_true",
+        help="Quote every row, instead of skipping destinations past quotes show are always above or below the threshold"
+    )
+    parser.add_argument(
+        "--grid",
+        type=parse_grid,
+        default=(1, 1),
+        help="Basic labels per A4 page as COLUMNSxROWS, eg. 2x2 for four A6 labels a page (default: 1x1)"
+    )
+    parser.add_argument(
+        "--stage",
+        default="all",
+        choices=["all", "orders", "basic", "combine"],
+        help="Run one step only: orders = quote and book Sendle labels, basic = draw the basic label PDF, "
+             "combine = merge the downloaded Sendle labels (default: all)"
+    )
+    parser.add_argument(
+        "--pdf-part-pages",
+        type=int,
+        default=PDF_PART_PAGES,
+        help=f"Pages built in memory before they are flushed to disk (default: {PDF_PART_PAGES})"
+    )
+    parser.add_argument(
+        "--split-pdf",
+        action="store_true",
+        help="Write the basic and Sendle PDFs as _part1.pdf, _part2.pdf, ... of --pdf-part-pages pages each instead of one file"
+    )
+    parser.add_argument(
+        "--store",
+        default=None,
+        help="SQLite order store to record Sendle references in (see store.py)"
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="Print every quote and the full Sendle request/response bodies instead of a progress line"
+    )
+    parser.add_argument(
+        "--metrics",
+        default=METRICS_PATH,
+        help=f"Where to save the Sendle latency and error metrics as JSON (default: {METRICS_PATH})"
+    )
 
     args = parser.parse_args()
-    config = WAREHOUSE_CONFIG[args.warehouse]
-
-    SENDER_INFO = config["label_sender_block"]
+    VERBOSE = args.verbose
+    quote_model = None if args.no_quote_model else load_quote_model()
+
+    if len(args.warehouse) > 1:
+        if args.csv is None or len(args.csv) != len(args.warehouse) or len(set(args.warehouse)) != len(args.warehouse):
+            parser.error("several warehouses need one --csv each, and each warehouse only once")
+        if args.stage != "all":
+            parser.error("--stage runs one warehouse at a time")
+        runs = [LabelRun(w, csv_filename, suffix=f"_w{w}", part_pages=args.pdf_part_pages, split_pdf=args.split_pdf)
+                for w, csv_filename in zip(args.warehouse, args.csv)]
+        generate_labels_for_warehouses(runs, args.threshold, args.store, quote_model, args.grid)
+    else:
+        run = LabelRun(args.warehouse[0], args.csv[0] if args.csv else CSV_FILENAME,
+                       part_pages=args.pdf_part_pages, split_pdf=args.split_pdf)
+        store = open_store(args.store) if args.store else None
+
+        if args.stage == "orders":
+            create_sendle_labels(run, price_threshold=args.threshold, store=store, quote_model=quote_model)
+        elif args.stage == "basic":
+            draw_basic_labels(run, args.grid)
+        elif args.stage == "combine":
+            combine_sendle_labels(run)
+        else:
+            generate_labels(run, price_threshold=args.threshold, store=store, quote_model=quote_model, grid=args.grid)
 
-    generate_labels(CSV_FILENAME, OUTPUT_FILENAME, config, price_threshold=args.threshold)
+    if METRICS.labels_total:
+        METRICS.show_progress(final=True)
+        METRICS.dump(args.metrics)
+        print(f"Sendle metrics saved to: {args.metrics}")
@@ -1,21 +1,47 @@
+import argparse
+import numpy as np
 import pandas as pd
 import re
+import sys
 from datetime import datetime
 import os
 
+from store import mark_tracking_file, open_store, tracking_file_changed, tracking_for, upsert_tracking
+
 # =========================
-# eBay dispatch module
+# shared tracking index
 # =========================
 
-def ebay_find_file_case_insensitive(filename):
-    target = filename.lower()
-    for f in os.listdir('.'):
-        if f.lower() == target:
-            return f
-    raise FileNotFoundError(f"File matching '{filename}' (case-insensitive) not found.")
+EBAY_ORDER_NUMBER_PATTERN = r'\d{2}-\d{5}-\d{5}'
+TRACKING_NUMBER_PATTERN = r'[A-Za-z0-9]{7,30}'
+SENDLE_REFERENCE_PATTERN = r'[A-Za-z0-9]{7}'
+# merged_labels.csv ids: one 8 character Kogan order id, or several joined with commas
+KOGAN_ID_PATTERN = r'\s*[A-Za-z0-9]{8}\s*(?:,\s*[A-Za-z0-9]{8}\s*)*'
+SCIENTIFIC_PATTERN = r'\d+(\.\d+)?[eE]\+?\d+'
+
+
+def scan_directory(directory='.'):
+    """
+    Lists the directory once. Returns {lower-cased filename: path} for case-insensitive lookups.
+    """
+    return {f.lower(): os.path.join(directory, f) for f in os.listdir(directory)}
+
+
+def find_file_case_insensitive(filename, files):
+    """
+    Looks up a file from scan_directory, ignoring case.
+    Returns the actual path if found, else raises an error.
+    """
+    try:
+        return files[filename.lower()]
+    except KeyError:
+        raise FileNotFoundError(f"File matching '{filename}' (case-insensitive) not found.")
 
 
-def ebay_normalize_tracking_number(x):
+def normalize_tracking_number(x):
+    """
+    Ensures tracking number is string, drops a leading ' and converts scientific notation if needed.
+    """
     try:
         text = str(x).strip()
         if text.startswith("'"):
@@ -27,22 +53,96 @@ def ebay_normalize_tracking_number(x):
         return ''
 
 
-def ebay_is_valid_tracking_number(tracking_number):
-    tracking_number = ebay_normalize_tracking_number(tracking_number)
-    if not tracking_number:
-        return False
-    if tracking_number.upper() in {'ELMS', 'NAN', 'NONE'}:
-        return False
-    return bool(re.fullmatch(r'[A-Za-z0-9]{7,30}', tracking_number))
+def normalize_tracking_numbers(values):
+    """
+    Vectorized normalize_tracking_number for a column read with dtype=str.
+    """
+    text = values.astype(str).str.strip().str.replace(r"^'", '', regex=True).str.strip()
+    scientific = text.str.fullmatch(SCIENTIFIC_PATTERN)
+    text[scientific] = text[scientific].map(normalize_tracking_number)
+    text[values.isna()] = ''
+    return text
+
+
+def read_tracking_csv(tracking_csv_path, order_ids=None, chunksize=100_000):
+    """
+    Reads tracking.csv with stripped headers and IDs.
+
+    When order_ids is given the file is streamed in chunks and only rows for those orders
+    are kept, so memory follows today's orders rather than the length of the history.
+    """
+    required_cols = {'ID', 'Tracking Number'}
+    chunks = [pd.read_csv(tracking_csv_path, dtype=str)] if order_ids is None else \
+        pd.read_csv(tracking_csv_path, dtype=str, chunksize=chunksize)
+
+    kept = []
+    for chunk in chunks:
+        chunk.columns = chunk.columns.str.strip()
+        if not required_cols.issubset(chunk.columns):
+            raise ValueError(f"{tracking_csv_path} must contain columns: {required_cols}")
+
+        chunk = chunk[['ID', 'Tracking Number']].copy()
+        chunk['ID'] = chunk['ID'].str.strip()
+        if order_ids is not None:
+            chunk = chunk[chunk['ID'].isin(order_ids)]
+        kept.append(chunk)
 
+    if not kept:
+        return pd.DataFrame(columns=['ID', 'Tracking Number'], dtype=str)
+    return pd.concat(kept, ignore_index=True)
 
-def ebay_is_valid_order_number(order_number):
-    return bool(re.fullmatch(r'\d{2}-\d{5}-\d{5}', str(order_number).strip()))
+
+def collect_order_ids(files):
+    """
+    The order IDs today's dispatch files can refer to, from kogan_orders.csv, eBay_orders.csv
+    and merged_labels.csv (combined ids are split).
+    """
+    order_ids = set()
+    if 'kogan_orders.csv' in files:
+        kogan_ids = pd.read_csv(files['kogan_orders.csv'], dtype=str, usecols=['OrderID'])['OrderID']
+        order_ids.update(kogan_ids.str.strip().dropna())
+    if 'ebay_orders.csv' in files:
+        ebay_ids = pd.read_csv(files['ebay_orders.csv'], dtype=str, header=1, usecols=lambda c: c.strip() == 'Order Number')
+        order_ids.update(ebay_ids.iloc[:, 0].str.strip().dropna())
+    if 'merged_labels.csv' in files:
+        merged_ids = pd.read_csv(files['merged_labels.csv'], dtype=str, usecols=['id'])['id']
+        order_ids.update(merged_ids.str.split(',').explode().str.strip().dropna())
+    return order_ids
+
+
+def load_tracking_index(tracking_csv_path, order_ids=None, chunksize=100_000):
+    """
+    Loads and normalizes tracking.csv once for every dispatch file.
+    Pass order_ids to stream the file and keep only those orders.
+
+    Returns:
+        pd.DataFrame: 'Tracking Number' and 'ebay_valid' columns indexed by the stripped order ID,
+        in file order. 'ebay_valid' marks rows with an eBay order number and a usable tracking number.
+    """
+    df = read_tracking_csv(tracking_csv_path, order_ids, chunksize)
+    df['Tracking Number'] = normalize_tracking_numbers(df['Tracking Number'])
+    return index_tracking(df)
 
 
-def ebay_read_orders_csv(orders_csv_path='ebay_orders.csv'):
-    orders_csv_path = ebay_find_file_case_insensitive(orders_csv_path)
+def index_tracking(df):
+    """
+    Indexes normalized 'ID'/'Tracking Number' rows by order ID and flags the eBay-usable ones.
+    """
+    df = df.copy()
+    tracking_number = df['Tracking Number']
+    df['ebay_valid'] = (
+        df['ID'].str.fullmatch(EBAY_ORDER_NUMBER_PATTERN, na=False)
+        & tracking_number.str.fullmatch(TRACKING_NUMBER_PATTERN)
+        & ~tracking_number.str.upper().isin({'ELMS', 'NAN', 'NONE'})
+    )
+
+    return df.set_index('ID')[['Tracking Number', 'ebay_valid']]
+
+# =========================
+# eBay dispatch module
+# =========================
 
+def ebay_read_orders_csv(orders_csv_path):
     # eBay exports commonly have a blank first row, then the actual header row
     df = pd.read_csv(orders_csv_path, dtype=str, header=1)
     df.columns = df.columns.str.strip()
@@ -58,45 +158,22 @@ def ebay_read_orders_csv(orders_csv_path='ebay_orders.csv'):
         raise ValueError(f"{orders_csv_path} must contain columns: {required_cols}")
 
     df['Order Number'] = df['Order Number'].astype(str).str.strip()
-    df = df[df['Order Number'].apply(ebay_is_valid_order_number)].copy()
+    df = df[df['Order Number'].str.fullmatch(EBAY_ORDER_NUMBER_PATTERN)].copy()
 
     return df
 
 
-def ebay_read_tracking_csv(tracking_csv_path='tracking.csv'):
-    tracking_csv_path = ebay_find_file_case_insensitive(tracking_csv_path)
-
-    df = pd.read_csv(tracking_csv_path, dtype=str)
-    df.columns = df.columns.str.strip()
-
-    required_cols = {'ID', 'Tracking Number'}
-    if not required_cols.issubset(df.columns):
-        raise ValueError(f"{tracking_csv_path} must contain columns: {required_cols}")
-
-    df['ID'] = df['ID'].astype(str).str.strip()
-    df['Tracking Number'] = df['Tracking Number'].apply(ebay_normalize_tracking_number)
-
-    df = df[df['ID'].apply(ebay_is_valid_order_number)].copy()
-    df = df[df['Tracking Number'].apply(ebay_is_valid_tracking_number)].copy()
-
-    return df
-
-
-def generate_ebay_dispatch_file(
-    orders_csv_path='ebay_orders.csv',
-    tracking_csv_path='tracking.csv',
-    output_csv_path='eBayDispatch.csv'
-):
+def generate_ebay_dispatch_file(orders_csv_path, tracking_index, output_csv_path='eBayDispatch.csv'):
     orders_df = ebay_read_orders_csv(orders_csv_path)
-    tracking_df = ebay_read_tracking_csv(tracking_csv_path)
+    tracking_df = tracking_index[tracking_index['ebay_valid']]
 
     merged_df = pd.merge(
         orders_df[['Order Number', 'Item Number', 'Item Title', 'Custom Label', 'Transaction ID']],
-        tracking_df[['ID', 'Tracking Number']],
+        tracking_df[['Tracking Number']],
         left_on='Order Number',
-        right_on='ID',
+        right_index=True,
         how='inner'
-    )
+    ).reset_index(drop=True)
 
     merged_df = merged_df.drop_duplicates(
         subset=['Order Number', 'Item Number', 'Transaction ID']
@@ -123,60 +200,10 @@ def generate_ebay_dispatch_file(
 # kogan dispatch module
 # =========================
 
-def trim_to_tmp(val):
-        if isinstance(val, str):
-            pos = val.find('TMP')
-            if pos != -1:
-                return val[pos:]  # keep from 'TMP' to end
-        return val
-
-def is_valid_id(id_str):
-    """
-    Checks if the ID is exactly 8 alphanumeric characters.
-    """
-    return bool(re.match(r'^[A-Za-z0-9]{8}$', str(id_str)))
-
-def is_composite_of_valid_ids(id_str):
-    """
-    Checks if all components of a possibly comma-separated ID string are valid IDs.
-    """
-    parts = str(id_str).split(',')
-    return all(is_valid_id(p.strip()) for p in parts)
-
-def find_file_case_insensitive(filename):
-    """
-    Searches for a file in the current directory, ignoring case.
-    Returns the actual filename if found, else raises an error.
-    """
-    lower_target = filename.lower()
-    for f in os.listdir('.'):
-        if f.lower() == lower_target:
-            return f
-    raise FileNotFoundError(f"File matching '{filename}' (case-insensitive) not found in current directory.")
-
-def carrier_from_tracking(tracking_number):
+def generate_dispatch_file_with_tracking(merged_csv_path, kogan_csv_path, tracking_index, dispatch_csv_path='koganDispatch.csv', dispatch_date=None):
     """
-    Returns the carrier based on the format of the tracking number.
-    """
-    if isinstance(tracking_number, str) and re.fullmatch(r'[A-Za-z0-9]{7}', tracking_number):
-        return 'SENDLE'
-    else:
-        return 'AUP'
-
-def normalize_tracking_number(x):
-    """
-    Ensures tracking number is string and converts scientific notation if needed.
-    """
-    try:
-        if isinstance(x, float) or re.match(r'^\d+(\.\d+)?[eE]\+?\d+$', str(x)):
-            return format(int(float(x)), 'f').rstrip('.0')
-        return str(x).strip()
-    except:
-        return ''
-
-def generate_dispatch_file_with_tracking(merged_csv_path, kogan_csv_path, tracking_csv_path, dispatch_csv_path):
-    """
-    Generates a dispatch file from merged_labels.csv, kogan_orders.csv, and tracking.csv.
+    Generates a dispatch file from merged_labels.csv, kogan_orders.csv, and the tracking index.
+    dispatch_date (a date or datetime) defaults to today.
     """
     # Load merged labels
     merged_df = pd.read_csv(merged_csv_path)
@@ -184,17 +211,17 @@ def generate_dispatch_file_with_tracking(merged_csv_path, kogan_csv_path, tracki
     merged_df['id'] = merged_df['id'].astype(str).str.strip()
 
     # Filter rows where ID is a single valid or valid composite
-    merged_df = merged_df[merged_df['id'].apply(is_composite_of_valid_ids)].copy()
+    merged_df = merged_df[merged_df['id'].str.fullmatch(KOGAN_ID_PATTERN)].copy()
 
     if merged_df.empty:
         print("No valid dispatch entries found after filtering.")
         return
 
     # Step 1: Split and clean the ID list
-    merged_df['primary_id'] = merged_df['id'].str.split(',').apply(lambda lst: [x.strip() for x in lst])
+    merged_df['primary_id'] = merged_df['id'].str.split(r'\s*,\s*', regex=True)
 
     # Step 2: Store the first ID separately for comparison
-    merged_df['first_id'] = merged_df['primary_id'].apply(lambda lst: lst[0])
+    merged_df['first_id'] = merged_df['primary_id'].str[0]
 
     # Step 3: Explode primary_id list
     merged_df = merged_df.explode('primary_id').reset_index(drop=True)
@@ -206,7 +233,6 @@ def generate_dispatch_file_with_tracking(merged_csv_path, kogan_csv_path, tracki
     merged_df.loc[merged_df['is_secondary'], 'id'] = merged_df.loc[merged_df['is_secondary'], 'primary_id']
 
     # Load kogan_orders.csv
-    kogan_csv_path = find_file_case_insensitive(kogan_csv_path)
     kogan_df = pd.read_csv(kogan_csv_path, dtype=str)
     kogan_df['Quantity'] = pd.to_numeric(kogan_df['Quantity'], errors='coerce')
 
@@ -218,80 +244,152 @@ def generate_dispatch_file_with_tracking(merged_csv_path, kogan_csv_path, tracki
     enriched_df = pd.merge(merged_df, kogan_df[['OrderID', 'ProductCode', 'Quantity']],
                            left_on='primary_id', right_on='OrderID', how='inner')
 
-    # Load tracking.csv
-    tracking_csv_path = find_file_case_insensitive(tracking_csv_path)
-    tracking_df = pd.read_csv(tracking_csv_path, dtype={'Tracking Number': str})
-    tracking_df.columns = tracking_df.columns.str.strip()
-    tracking_df['Tracking Number'] = tracking_df['Tracking Number'].apply(normalize_tracking_number)
-
-    required_tracking_cols = {'ID', 'Tracking Number'}
-    if not required_tracking_cols.issubset(set(tracking_df.columns)):
-        raise ValueError(f"{tracking_csv_path} must contain columns: {required_tracking_cols}")
-
     # Merge tracking info using primary_id
-    enriched_df = pd.merge(enriched_df, tracking_df[['ID', 'Tracking Number']],
-                           left_on='id', right_on='ID', how='left')
+    enriched_df = pd.merge(enriched_df, tracking_index[['Tracking Number']],
+                           left_on='id', right_index=True, how='left').reset_index(drop=True)
 
     # Build final DataFrame
+    tracking_number = enriched_df['Tracking Number']
+    connote = tracking_number.fillna('ELMS')
+
     final_df = pd.DataFrame()
-    final_df['CONNOTE'] = enriched_df['Tracking Number'].fillna('ELMS').apply(
-        lambda x: f"'{x}" if pd.notna(x) and x != 'ELMS' else x
-    )
+    final_df['CONNOTE'] = ("'" + connote).where(connote != 'ELMS', connote)
     final_df['ITEM'] = enriched_df['ProductCode']
     final_df['SERIAL_NUMBER'] = ''
-    final_df['DISPATCH_DATE'] = datetime.today().strftime('%d/%m/%Y')
+    final_df['DISPATCH_DATE'] = (dispatch_date or datetime.today()).strftime('%d/%m/%Y')
     final_df['ORDER_ID'] = enriched_df['primary_id']
     final_df['QUANTITY'] = enriched_df['Quantity']
     final_df['WAREHOUSE'] = 'AUNEX'
-    final_df['CARRIER'] = enriched_df['Tracking Number'].apply(carrier_from_tracking)
+    final_df['CARRIER'] = np.where(tracking_number.str.fullmatch(SENDLE_REFERENCE_PATTERN, na=False), 'SENDLE', 'AUP')
     final_df['amt'] = enriched_df['amt']
-    
+
     # parcels
     final_df.loc[(final_df['CONNOTE'] == 'ELMS') & (final_df['amt'] >= 30), 'CONNOTE'] = ''
 
-    # Save final output to 'koganDispatch.csv'
-    dispatch_csv_path = 'koganDispatch.csv'
-    final_df['CONNOTE'] = final_df['CONNOTE'].apply(trim_to_tmp)
-    
+    # Keep connotes from 'TMP' to the end
+    final_df['CONNOTE'] = final_df['CONNOTE'].str.replace(r'^.*?(?=TMP)', '', regex=True)
+
     final_df.to_csv(dispatch_csv_path, index=False)
     print(f"Dispatch file saved to: {dispatch_csv_path}")
 
-if __name__ == '__main__':
+# =========================
+# dispatch engine
+# =========================
+
+def load_tracking_index_from_store(conn, tracking_csv_path, order_ids, chunksize=100_000):
+    """
+    Looks up the tracking numbers of today's orders in the order store, in place of joining
+    the whole tracking.csv. tracking.csv is only read and upserted
+    when it changed since the last run (by size and modification time), and then only
+    new or changed tracking numbers are written.
+    The store keeps one tracking number per order, the last one in the file.
+    """
+    path, stat = os.path.abspath(tracking_csv_path), os.stat(tracking_csv_path)
+    if tracking_file_changed(conn, path, stat):
+        df = read_tracking_csv(tracking_csv_path, None, chunksize)
+        df['Tracking Number'] = normalize_tracking_numbers(df['Tracking Number'])
+        upsert_tracking(conn, df)
+        mark_tracking_file(conn, path, stat)
+    return index_tracking(tracking_for(conn, order_ids))
+
+
+def run_dispatch(directory='.', output_dir=None, stream=False, chunksize=100_000, store=None, only=None, dispatch_date=None):
+    """
+    Builds every dispatch file in one pass: scans the directory once, loads tracking.csv
+    once and generates the Kogan and eBay files from the same tracking index.
+    With stream=True only tracking rows for today's orders are kept while reading.
+    With a store connection tracking.csv is upserted into it and the tracking numbers of
+    today's orders are looked up there instead; the orders and merged labels still come
+    from today's CSVs. only='kogan' or 'ebay' builds just that file.
+    A merged_labels.csv already in output_dir is used over one in directory.
+
+    A failing file does not stop the other one from being built.
+
+    Returns:
+        list: What failed, empty when everything asked for was built or skipped for
+            missing inputs.
+    """
+    failures = []
+    files = scan_directory(directory)
+    output_dir = output_dir or directory
+    if os.path.exists(os.path.join(output_dir, 'merged_labels.csv')):
+        files['merged_labels.csv'] = os.path.join(output_dir, 'merged_labels.csv')
+
+    tracking_index = None
+    if 'tracking.csv' in files:
+        try:
+            if store is not None:
+                tracking_index = load_tracking_index_from_store(
+                    store, files['tracking.csv'], collect_order_ids(files), chunksize
+                )
+            else:
+                order_ids = collect_order_ids(files) if stream else None
+                tracking_index = load_tracking_index(files['tracking.csv'], order_ids, chunksize)
+        except Exception as e:
+            print(f'Loading tracking.csv failed: {e}')
+            failures.append(f'tracking.csv: {e}')
+
     # Kogan dispatch generation
-    try:
-        if (
-            any(f.lower() == 'merged_labels.csv' for f in os.listdir('.')) and
-            any(f.lower() == 'kogan_orders.csv' for f in os.listdir('.')) and
-            any(f.lower() == 'tracking.csv' for f in os.listdir('.'))
-        ):
-            merged_csv = 'merged_labels.csv'
-            kogan_csv = 'kogan_orders.csv'
-            tracking_csv = 'tracking.csv'
-            dispatch_csv = 'koganDispatch.csv'
-
-            generate_dispatch_file_with_tracking(
-                merged_csv,
-                kogan_csv,
-                tracking_csv,
-                dispatch_csv
-            )
-        else:
-            print('Skipping Kogan dispatch generation: merged_labels.csv, kogan_orders.csv, or tracking.csv not found.')
-    except Exception as e:
-        print(f'Kogan dispatch generation failed: {e}')
+    if only != 'ebay':
+        try:
+            if tracking_index is not None and 'merged_labels.csv' in files and 'kogan_orders.csv' in files:
+                generate_dispatch_file_with_tracking(
+                    find_file_case_insensitive('merged_labels.csv', files),
+                    find_file_case_insensitive('kogan_orders.csv', files),
+                    tracking_index,
+                    os.path.join(output_dir, 'koganDispatch.csv'),
+                    dispatch_date
+                )
+            else:
+                print('Skipping Kogan dispatch generation: merged_labels.csv, kogan_orders.csv, or tracking.csv not found.')
+        except Exception as e:
+            print(f'Kogan dispatch generation failed: {e}')
+            failures.append(f'Kogan dispatch: {e}')
 
     # eBay dispatch generation
-    try:
-        if (
-            any(f.lower() == 'ebay_orders.csv' for f in os.listdir('.')) and
-            any(f.lower() == 'tracking.csv' for f in os.listdir('.'))
-        ):
-            generate_ebay_dispatch_file(
-                orders_csv_path='ebay_orders.csv',
-                tracking_csv_path='tracking.csv',
-                output_csv_path='eBayDispatch.csv'
-            )
-        else:
-            print('Skipping eBay dispatch generation: ebay_orders.csv or tracking.csv not found.')
-    except Exception as e:
-        print(f'eBay dispatch generation failed: {e}')
\ No newline at end of file
+    if only != 'kogan':
+        try:
+            if tracking_index is not None and 'ebay_orders.csv' in files:
+                generate_ebay_dispatch_file(
+                    find_file_case_insensitive('ebay_orders.csv', files),
+                    tracking_index,
+                    os.path.join(output_dir, 'eBayDispatch.csv')
+                )
+            else:
+                print('Skipping eBay dispatch generation: ebay_orders.csv or tracking.csv not found.')
+        except Exception as e:
+            print(f'eBay dispatch generation failed: {e}')
+            failures.append(f'eBay dispatch: {e}')
+
+    return failures
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate Kogan and eBay dispatch files from tracking.csv.")
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Read tracking.csv in chunks, keeping only today's orders (for long tracking histories)"
+    )
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=100_000,
+        help="Rows per tracking.csv chunk with --stream (default: 100000)"
+    )
+    parser.add_argument(
+        "--store",
+        default=None,
+        help="SQLite order store to upsert tracking into and look tracking numbers up from (see store.py)"
+    )
+    parser.add_argument(
+        "--only",
+        choices=["kogan", "ebay"],
+        default=None,
+        help="Build only the Kogan or only the eBay dispatch file"
+    )
+    args = parser.parse_args()
+
+    failures = run_dispatch('.', stream=args.stream, chunksize=args.chunksize,
+                            store=open_store(args.store) if args.store else None, only=args.only)
+    # A non-zero exit lets pipeline.py see the stage failed
+    sys.exit(1 if failures else 0)
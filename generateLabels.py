@@ -1,6 +1,12 @@
+import argparse
+import hashlib
+import numpy as np
 import os
 import pandas as pd
 import re
+import time
+
+from store import open_store, upsert_orders
 # Define the standard column names for each platform
 COLUMN_MAPPING = {
     'shopify': {
@@ -47,6 +53,93 @@ COLUMN_MAPPING = {
     }
 }
 
+# Export columns parsed as numbers, everything else is read as text
+NUMERIC_COLUMNS = {'Quantity': 'float64', 'amt': 'float64'}
+
+# Compact dtypes for the standardized order table. Low-cardinality text columns are
+# categoricals and postcodes are stored as 2-byte integers (nullable, so blanks survive).
+STANDARD_DTYPES = {
+    'source_platform': 'category',
+    'shipping_method': 'category',
+    'state': 'category',
+    'city': 'category',
+    'zip': 'UInt16',
+}
+
+## Precompiled cleaning patterns, shared by every platform and the single order path
+PLATFORM_CODES = {'shopify': 'SP', 'ebay': 'NG', 'kogan': 'KG', 'catch': 'C'}
+PLATFORM_PREFIXES = {code: re.compile(r'^\[' + code + r'\]/') for code in PLATFORM_CODES.values()}
+# [KG-, [USAMS- and [UB- are dropped in that order, so a chain like [KG-USAMS-C5] ends up as [C5]
+KOGAN_BRAND_PREFIX = re.compile(r'\[(?=KG-|USAMS-|UB-)(?:KG-)?(?:USAMS-)?(?:UB-)?')
+SHOPIFY_TRACKED_TAGS = re.compile(r'kogan|mydeal|everyday market', re.IGNORECASE)
+EBAY_SUMMARY_ROW = re.compile(r'record\(s\) downloaded', re.IGNORECASE)
+ENVELOPE_PATTERN = re.compile(r'\[(.*?)\](?:/\[(.*?)\])?')
+NON_DIGIT = re.compile(r'\D')
+AU_DOLLAR = 'AU $'
+
+def internStrings(series):
+    """
+    Makes every repeated string in the column share a single object.
+
+    Parameters:
+        series (pd.Series): An object column with many repeated values (eg. custom_label).
+
+    Returns:
+        pd.Series: The same values, deduplicated in memory.
+    """
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    return pd.Series(uniques.take(codes), index=series.index, name=series.name, dtype=object)
+
+def apply_unique(func, *columns):
+    """
+    Applies func row by row over the columns, but only calls it once per distinct value
+    (or combination of values across the columns). The columns are factorized, func runs
+    on the uniques and the results are broadcast back through the codes, so the cost
+    follows the number of distinct labels rather than the number of rows.
+
+    Parameters:
+        func (callable): Called with one value from each column, like a row-wise apply.
+        *columns (pd.Series): Aligned columns of the same length.
+
+    Returns:
+        pd.Series: func's result for every row, on the index of the first column.
+    """
+    codes = np.zeros(len(columns[0]), dtype=np.int64)
+    for column in columns:
+        column_codes, column_uniques = pd.factorize(column, use_na_sentinel=False)
+        codes, _ = pd.factorize(codes * len(column_uniques) + column_codes)
+
+    # Codes are numbered in order of first appearance, so this is one row per unique
+    first_rows = np.unique(codes, return_index=True)[1]
+    results = np.empty(len(first_rows), dtype=object)
+    for code, row in enumerate(first_rows):
+        results[code] = func(*(column.iat[row] for column in columns))
+    return pd.Series(results[codes], index=columns[0].index, name=columns[0].name, dtype=object)
+
+def enforce_schema(df):
+    """
+    Casts the standardized table to STANDARD_DTYPES and interns the custom labels.
+    Columns that are not present (eg. no shipping_method in an empty export) are skipped.
+    """
+    for column, dtype in STANDARD_DTYPES.items():
+        if column not in df.columns:
+            continue
+        if column == 'zip':
+            df[column] = pd.to_numeric(df[column].replace('', None), errors='coerce').astype(dtype)
+        else:
+            df[column] = df[column].astype(dtype)
+    if 'custom_label' in df.columns:
+        df['custom_label'] = internStrings(df['custom_label'])
+    return df
+
+def write_standardized(df, path):
+    """
+    Saves the standardized table, writing postcodes back as 4 digit strings (eg. 0800).
+    """
+    if 'zip' in df.columns and isinstance(df['zip'].dtype, pd.UInt16Dtype):
+        df = df.assign(zip=df['zip'].astype('string').str.zfill(4))
+    df.to_csv(path, index=False)
+
 def multiplyCustomLabel(row):
     """
     Multiplies the Quantity based on the multiplier in the custom_label.
@@ -77,6 +170,12 @@ def multiplyCustomLabel(row):
 
     return ', '.join(updated_labels)  # Join all updated labels with a comma
 
+def multiplyLabel(label, quantity):
+    """
+    multiplyCustomLabel for a label and quantity given separately, for apply_unique.
+    """
+    return multiplyCustomLabel({'custom_label': label, 'Quantity': quantity})
+
 def isBlank (myString):
     return not (myString and myString.strip())
 
@@ -94,7 +193,7 @@ def extractEnv(value):
         return ""  # Handle non-string inputs safely
 
     # Pattern for [*]/[*] or [*]
-    match = re.search(r'\[(.*?)\](?:/\[(.*?)\])?', value)
+    match = ENVELOPE_PATTERN.search(value)
     
     if match:
         if match.group(2):  # If the second group (after the slash) exists
@@ -139,6 +238,26 @@ def replaceLabel(customLabel,shipping):
         return customLabel
     return customLabel.replace(oldEnv,newEnv)
     
+def shopify_shipping_method(tags):
+    """
+    Shopify orders tagged from a marketplace (Kogan, MyDeal, Everyday Market) ship tracked.
+    """
+    return "tracking" if isinstance(tags, str) and SHOPIFY_TRACKED_TAGS.search(tags) else "untracked"
+
+def ebay_shipping_method(postage_service):
+    """
+    Maps the eBay postage service to untracked, tracking or express.
+    Anything that is not clearly tracked or express falls back to untracked.
+    """
+    service = str(postage_service).lower()
+    if "untracked" in service:
+        return "untracked"
+    elif "tracked" in service or "tracking" in service:
+        return "tracking"
+    elif "express" in service:
+        return "express"
+    return "untracked"
+
 def addPlatform(customLabel,platformStr):
     if customLabel.count('[') > 1:
         return customLabel # This is already annotated, skip
@@ -149,25 +268,94 @@ def addPlatform(customLabel,platformStr):
     
     return "["+platformStr+"]/"+customLabel
     
+def read_export(filepath, platform):
+    """
+    Reads only the columns COLUMN_MAPPING knows for the platform. The header is read first so
+    the rest of the export is parsed with usecols and fixed dtypes: text stays text and only
+    the quantity and price columns are parsed as numbers (eBay prices are "AU $" strings).
+    """
+    skiprows = [0, 2] if platform == 'ebay' else None
+    column_mapping = COLUMN_MAPPING.get(platform, {})
+
+    header = pd.read_csv(filepath, skiprows=skiprows, nrows=0).columns
+    usecols = [col for col in header if col.lower() in column_mapping]
+    dtype = {}
+    for col in usecols:
+        standard = column_mapping[col.lower()]
+        numeric = standard in NUMERIC_COLUMNS and not (platform == 'ebay' and standard == 'amt')
+        dtype[col] = NUMERIC_COLUMNS[standard] if numeric else str
+
+    # The c engine on purpose: pyarrow, cast to str, turns blank cells into "None"/"nan"
+    # and was no faster on these exports
+    return pd.read_csv(filepath, skiprows=skiprows, usecols=usecols, dtype=dtype, engine='c')
+
+## Shared cleaning stage
+def normalize_label(label, platform):
+    """
+    The custom label clean-up of every platform in one pass: cleanCustomLabel, the Kogan
+    brand prefixes, then the platform tag dropped and added back in the standard form.
+    """
+    label = cleanCustomLabel(label)
+    if platform == 'kogan':
+        label = KOGAN_BRAND_PREFIX.sub('[', label.lstrip('NEX-'))
+    code = PLATFORM_CODES[platform]
+    return addPlatform(PLATFORM_PREFIXES[code].sub('', label), code)
+
+def clean_postcode(value):
+    """
+    Postcode as 4 digits, eg. "'3810" -> "3810" and "800" -> "0800".
+    """
+    return NON_DIGIT.sub('', str(value)).zfill(4)[:4]
+
+def parse_amount(value):
+    """
+    Price of an export cell as a float, 0 when blank or unreadable (eg. eBay's "AU $12.50").
+    """
+    try:
+        return float(str(value).replace(AU_DOLLAR, ''))
+    except ValueError:
+        return 0.0
+
+def parse_quantity(value):
+    """
+    Line quantity of an export cell as a float, 1 when blank or unreadable (as in clean_amounts).
+    """
+    try:
+        return float(str(value).strip())
+    except ValueError:
+        return 1.0
+
+def clean_amounts(amounts, quantities=None):
+    """
+    Prices as floats with blanks as 0, multiplied by the line quantity when quantities are
+    given (a blank quantity counts as 1). Text prices such as eBay's "AU $12.50" are parsed.
+    """
+    if not pd.api.types.is_numeric_dtype(amounts):
+        amounts = pd.to_numeric(amounts.astype(str).str.replace(AU_DOLLAR, '', regex=False), errors='coerce')
+    amounts = amounts.astype(float).fillna(0)
+    if quantities is not None:
+        amounts = amounts * pd.to_numeric(quantities, errors='coerce').fillna(1)
+    return amounts
+
 def process_file(filepath, platform):
-    if platform == 'ebay':
-        df = pd.read_csv(filepath, skiprows=[0, 2])
-    else:
-        df = pd.read_csv(filepath)
+    df = read_export(filepath, platform)
 
     df.columns = df.columns.str.lower()
     column_mapping = COLUMN_MAPPING.get(platform, {})
-    filtered_columns = {col: column_mapping[col] for col in df.columns if col in column_mapping}
-    df = df[list(filtered_columns.keys())]
-    df.rename(columns=filtered_columns, inplace=True)
+    df.rename(columns=column_mapping, inplace=True)
+
+    if platform in PLATFORM_CODES:
+        # eBay and Kogan give the price of one item, Shopify and Catch the order total
+        per_item = platform in ('ebay', 'kogan')
+        df['amt'] = clean_amounts(df['amt'], df['Quantity'] if per_item else None)
+        df['custom_label'] = apply_unique(lambda x: normalize_label(x, platform), df['custom_label'].fillna('').astype(str))
 
-    df.fillna('', inplace=True)
+    df = df.fillna('')
 
     '''
         =============   Shopify   =============
     '''
     if platform == 'shopify':
-        df['custom_label'] = df['custom_label'].astype(str).apply(lambda x: cleanCustomLabel(x))
         """
         handle shopify cases with NO SHIPPING DETAILS
         """
@@ -199,94 +387,42 @@ def process_file(filepath, platform):
             else row['rname'], 
             axis=1
         )
-        df['shipping_method'] = df['tags'].str.contains(r'kogan|mydeal|everyday market', case=False, na=False).apply(
+        df['shipping_method'] = df['tags'].str.contains(SHOPIFY_TRACKED_TAGS, na=False).apply(
             lambda x: "tracking" if x else "untracked"
         )
 
-        df['amt'] = df['amt'].fillna(0)  # Replace NaN with 0 to avoid conversion errors
-        df['amt'] = df['amt'].replace('', 0).astype(float)  # Convert empty strings to 0 before converting to float
-               
-        df['custom_label'] = df['custom_label'].str.replace(r'^\[SP\]/', '', regex=True)
-        df['custom_label'] = df['custom_label'].astype(str).apply(lambda x: addPlatform(x, "SP"))
-        df['custom_label'] = df.apply(lambda row: replaceLabel(row['custom_label'], row['shipping_method']), axis=1)
-        df['zip'] = df['zip'].astype(str).str.replace(r'\D', '', regex=True).str.zfill(4).str.slice(0, 4)
-        df['custom_label'] = df.apply(multiplyCustomLabel, axis=1)
-        df['Quantity'] = 1
-
 
         '''
         =============   eBay   =============
         '''
     elif platform == 'ebay':
-        df['custom_label'] = df['custom_label'].astype(str).apply(lambda x: cleanCustomLabel(x))
-        df = df[~df['id'].str.contains('record\\(s\\) downloaded', case=False, na=False)]
-        df['amt'] = pd.to_numeric(df['amt'].str.replace('AU $', '', regex=False), errors='coerce')
-        df['amt'].fillna(0, inplace=True)
-        df.loc[df['Quantity'].astype(str).str.strip() != '', 'amt'] = (
-            df.loc[df['Quantity'].astype(str).str.strip() != '', 'amt'].astype(float) *
-            df.loc[df['Quantity'].astype(str).str.strip() != '', 'Quantity'].astype(float)
-        )
+        df = df[~df['id'].str.contains(EBAY_SUMMARY_ROW, na=False)]
         df['address'] = df.apply(
             lambda row: row['address1'] + ' ' + row['address2'] if 'ebay:' not in row['address1'].lower() else row['address2'],
             axis=1
         )
-        shippingMethod = df['shipping_method'].str.lower()
-        df['shipping_method'] = shippingMethod.apply(
-            lambda x: 
-                "untracked" if "untracked" in x
-                else "tracking" if "tracked" in x or "tracking" in x
-                else "express" if "express" in x
-                else ""
-        )
-
-        #fallback to untracked as long as not tracking or express
-        df['shipping_method'] = df.apply(
-            lambda row: 'untracked' if row['shipping_method'] not in ['tracking', 'express']
-                        else row['shipping_method'], 
-            axis=1
-        )
-        df['custom_label'] = df['custom_label'].str.replace(r'^\[NG\]/', '', regex=True)
-        df['custom_label'] = df['custom_label'].astype(str).apply(lambda x: addPlatform(x, "NG"))
-        df['custom_label'] = df.apply(lambda row: replaceLabel(row['custom_label'], row['shipping_method']), axis=1)
-        df['zip'] = df['zip'].astype(str).str.replace(r'\D', '', regex=True).str.zfill(4).str.slice(0, 4)
-        df['custom_label'] = df.apply(multiplyCustomLabel, axis=1)
-        df['Quantity'] = 1
+        df['shipping_method'] = apply_unique(ebay_shipping_method, df['shipping_method'])
 
         '''
         =============   Kogan   =============
         '''
     elif platform == 'kogan':
-        df['custom_label'] = df['custom_label'].astype(str).apply(lambda x: cleanCustomLabel(x))
         df['address'] = df['address1'] + ' ' + df['address2'].astype(str)
-        df['amt'].fillna(0, inplace=True)
-        df['amt'] = df['amt'].astype(float) * df['Quantity'].astype(float)
-        df['shipping_method'] = 'untracked'
-        df['custom_label'] = df['custom_label'].str.lstrip('NEX-')
-        df['custom_label'] = df['custom_label'].str.replace('[KG-','[',regex=False)
-        df['custom_label'] = df['custom_label'].str.replace('[USAMS-','[',regex=False)
-        df['custom_label'] = df['custom_label'].str.replace('[UB-','[',regex=False)
-        df['custom_label'] = df['custom_label'].str.replace(r'^\[KG\]/', '', regex=True)
-        df['custom_label'] = df['custom_label'].astype(str).apply(lambda x: addPlatform(x, "KG"))
-        df['custom_label'] = df.apply(lambda row: replaceLabel(row['custom_label'], " "), axis=1) #KG doesnt need shipping edit
-        df['zip'] = df['zip'].astype(str).str.replace(r'\D', '', regex=True).str.zfill(4).str.slice(0, 4)
-        df['custom_label'] = df.apply(multiplyCustomLabel, axis=1)
-        df['Quantity'] = 1
+        df['shipping_method'] = 'untracked' #KG doesnt need shipping edit
 
         '''
         =============   Catch   =============
         '''
     elif platform == 'catch':
-        df['custom_label'] = df['custom_label'].astype(str).apply(lambda x: cleanCustomLabel(x))
-        df['address'] = df['company'] + ' ' + df['address1'].fillna('') + ' ' + df['address2']
+        df['address'] = df['company'] + ' ' + df['address1'] + ' ' + df['address2']
         df['rname'] = df['fname'] + ' ' + df['lname']
-        df['amt'].fillna(0, inplace=True)
         df['shipping_method'] = 'untracked'
-        df['custom_label'] = df['custom_label'].str.replace(r'^\[C\]/', '', regex=True)
-        df['custom_label'] = df['custom_label'].astype(str).apply(lambda x: addPlatform(x, "C"))
-        df['custom_label'] = df.apply(lambda row: replaceLabel(row['custom_label'], row['shipping_method']), axis=1)
-        df['zip'] = df['zip'].astype(str).str.replace(r'\D', '', regex=True).str.zfill(4).str.slice(0, 4)
-        df['custom_label'] = df.apply(multiplyCustomLabel, axis=1)
+
+    if platform in PLATFORM_CODES:
+        df['custom_label'] = apply_unique(replaceLabel, df['custom_label'], df['shipping_method'])
+        df['custom_label'] = apply_unique(multiplyLabel, df['custom_label'], df['Quantity'])
         df['Quantity'] = 1
+        df['zip'] = apply_unique(clean_postcode, df['zip'])
 
     #finishing up
     df['address'] = df['address'].str.strip()
@@ -295,7 +431,110 @@ def process_file(filepath, platform):
     df.reset_index(drop=True, inplace=True)
     return df
 
-def read_and_standardize(directory):
+## Single order fast path
+
+def standardize_record(record, platform):
+    """
+    process_file for a single order line, in plain Python. Gives the same custom_label,
+    shipping_method and amt as the batch path without building a DataFrame.
+
+    Parameters:
+        record (dict): One export row, keyed by the export's column names (any case) or
+            by the standardized names (eg. custom_label, Quantity).
+        platform (str): shopify, ebay, kogan or catch.
+
+    Returns:
+        dict: id, custom_label, shipping_method and amt of the standardized line.
+    """
+    if platform not in PLATFORM_CODES:
+        raise ValueError(f"Unknown platform: {platform}")
+    column_mapping = COLUMN_MAPPING[platform]
+    fields = {column_mapping.get(key.lower(), key): ('' if value is None else value) for key, value in record.items()}
+
+    label = normalize_label(str(fields.get('custom_label', '')), platform)
+    quantity = parse_quantity(fields.get('Quantity', 1))
+    amt = parse_amount(fields.get('amt', ''))
+
+    if platform == 'shopify':
+        shipping_method = shopify_shipping_method(fields.get('tags', ''))
+    elif platform == 'ebay':
+        shipping_method = ebay_shipping_method(fields.get('shipping_method', ''))
+        amt *= quantity
+    elif platform == 'kogan':
+        shipping_method = 'untracked'
+        amt *= quantity
+    else:
+        shipping_method = 'untracked'
+
+    label = replaceLabel(label, shipping_method)
+    label = multiplyLabel(label, quantity)
+
+    return {
+        'id': str(fields.get('id', '')).strip(),
+        'custom_label': label,
+        'shipping_method': shipping_method,
+        'amt': amt,
+    }
+
+## Standardization cache
+CACHE_DIR = '.standardize_cache'
+CACHE_MAX_MB = 512
+CACHE_MAX_AGE_DAYS = 14
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Any edit to this file changes the version, so cached results never outlive the code that made them
+CODE_VERSION = file_digest(__file__)[:16]
+
+def cache_path(cache_dir, filepath, platform):
+    """
+    Where the standardized result of this exact export is cached: the file's content hash,
+    its platform and the code version together name the entry.
+    """
+    key = hashlib.sha256(f"{file_digest(filepath)}:{platform}:{CODE_VERSION}".encode()).hexdigest()
+    return os.path.join(cache_dir, f"{key}.pkl")
+
+def evict_cache(cache_dir, max_mb=CACHE_MAX_MB, max_age_days=CACHE_MAX_AGE_DAYS):
+    """
+    Drops entries older than max_age_days, then the least recently used ones until the
+    cache fits in max_mb.
+    """
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.is_file() and entry.name.endswith('.pkl'):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    cutoff = time.time() - max_age_days * 86400
+    total = sum(size for _, size, _ in entries)
+    for mtime, size, path in sorted(entries):
+        if mtime >= cutoff and total <= max_mb * 1024 * 1024:
+            break
+        os.remove(path)
+        total -= size
+
+def process_file_cached(filepath, platform, cache_dir):
+    """
+    process_file, reusing the result from cache_dir when the same export was standardized before.
+    """
+    path = cache_path(cache_dir, filepath, platform)
+    if os.path.exists(path):
+        os.utime(path)  # Mark as recently used for eviction
+        print("Loaded from cache")
+        return pd.read_pickle(path)
+
+    df = process_file(filepath, platform)
+    os.makedirs(cache_dir, exist_ok=True)
+    df.to_pickle(path + '.tmp')
+    os.replace(path + '.tmp', path)
+    return df
+
+def read_and_standardize(directory, cache_dir=None):
     all_data = []
 
     # Iterate through files in the directory
@@ -305,7 +544,10 @@ def read_and_standardize(directory):
             filepath = os.path.join(directory, filename)
             print("----------------------------------------------------------------")
             print(f"Processing file: {filename}, Detected platform: {platform}")
-            df = process_file(filepath, platform)
+            if cache_dir:
+                df = process_file_cached(filepath, platform, cache_dir)
+            else:
+                df = process_file(filepath, platform)
             
             # Skip empty DataFrames
             if not df.empty:
@@ -314,20 +556,43 @@ def read_and_standardize(directory):
             
             print("================================================================")
 
+    if cache_dir and os.path.isdir(cache_dir):
+        evict_cache(cache_dir)
+
     # Combine all data into a single DataFrame
     if all_data:
-        combined_df = pd.concat(all_data, ignore_index=True, sort=False)
+        combined_df = enforce_schema(pd.concat(all_data, ignore_index=True, sort=False))
     else:
         combined_df = pd.DataFrame()  # Return an empty DataFrame if no data
 
     return combined_df
 
-# Set the directory containing the CSV files
-csv_directory = os.getcwd()  # Current directory
-
-# Read and standardize all files
-standardized_df = read_and_standardize(csv_directory)
-
-# After the standardized DataFrame is created
-standardized_df.to_csv('standardized_columns.csv', index=False)  # Save to a CSV file
-# print(standardized_df.head())  # Print the first few rows of the DataFrame
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Standardize every *_orders.csv export into standardized_columns.csv.")
+    parser.add_argument(
+        "--store",
+        default=None,
+        help="SQLite order store to upsert the standardized orders into (see store.py)"
+    )
+    parser.add_argument(
+        "--cache",
+        nargs='?',
+        const=CACHE_DIR,
+        default=None,
+        help=f"Reuse the standardized result of exports that have not changed (default folder: {CACHE_DIR})"
+    )
+    args = parser.parse_args()
+
+    # Set the directory containing the CSV files
+    csv_directory = os.getcwd()  # Current directory
+
+    # Read and standardize all files
+    standardized_df = read_and_standardize(csv_directory, cache_dir=args.cache)
+
+    # After the standardized DataFrame is created
+    write_standardized(standardized_df, 'standardized_columns.csv')  # Save to a CSV file
+
+    if args.store and not standardized_df.empty:
+        stored = upsert_orders(open_store(args.store), standardized_df)
+        print(f"Stored {stored} order lines in {args.store}")
+    # print(standardized_df.head())  # Print the first few rows of the DataFrame
@@ -0,0 +1,128 @@
+import argparse
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Importing these loads PhoneModelMSDB.csv, cables.csv and the compiled patterns once for the whole session
+from generateLabels import PLATFORM_CODES, standardize_record
+from merge import is_ebay_style_id, merge_parcel, splitLabel
+
+MAX_BODY_BYTES = 1024 * 1024
+
+
+def label_order(platform, lines):
+    """
+    Standardizes and merges the lines of one order into its packing label, the same label
+    generateLabels.py and merge.py would give the order if it shipped on its own.
+
+    Parameters:
+        platform (str): shopify, ebay, kogan or catch.
+        lines (list): The order's export rows, see standardize_record.
+
+    Returns:
+        dict: The label and its parts, ready to send back as JSON.
+    """
+    if not lines:
+        raise ValueError("Order has no lines")
+    standardized = [standardize_record(line, platform) for line in lines]
+
+    amounts = [line['amt'] for line in standardized]
+    order_id = next((line['id'] for line in standardized if line['id']), '')
+    # eBay exports a summary row holding the whole order's total next to its lines
+    if is_ebay_style_id(order_id) and len(amounts) > 1:
+        amounts[amounts.index(max(amounts))] = 0
+
+    amt = sum(amounts)
+    label, sort = merge_parcel([line['custom_label'] for line in standardized], amt)
+    platform_code, envelope, items = splitLabel(label) or (PLATFORM_CODES[platform], '', '')
+    return {
+        'id': order_id,
+        'label': label,
+        'platform': platform_code,
+        'envelope': envelope,
+        'items': items.strip(),
+        'shipping_method': standardized[0]['shipping_method'],
+        'amt': round(amt, 2),
+        'sort': sort,
+    }
+
+
+class LabelHandler(BaseHTTPRequestHandler):
+    """
+    POST /label with {"platform": "ebay", "lines": [{...export row...}, ...]}
+    (or a single "record") returns the order's label. GET /health is for monitoring.
+    """
+    quiet = False
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.send_json(200, {'status': 'ok'})
+        else:
+            self.send_json(404, {'error': f"Unknown path: {self.path}"})
+
+    def do_POST(self):
+        if self.path != '/label':
+            self.send_json(404, {'error': f"Unknown path: {self.path}"})
+            return
+
+        started = time.perf_counter()
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            if length > MAX_BODY_BYTES:
+                raise ValueError("Request body too large")
+            request = json.loads(self.rfile.read(length) or b'{}')
+            lines = request.get('lines') or [request.get('record') or {}]
+            result = label_order(str(request.get('platform', '')).lower(), lines)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            self.send_json(400, {'error': str(e)})
+            return
+
+        result['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 3)
+        self.send_json(200, result)
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            super().log_message(format, *args)
+
+
+def serve(host='127.0.0.1', port=8765, quiet=False):
+    LabelHandler.quiet = quiet
+    server = ThreadingHTTPServer((host, port), LabelHandler)
+    print(f"Label service listening on http://{host}:{port}/label (Ctrl+C to stop)", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopped label service.")
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve packing labels for single orders over HTTP/JSON.")
+    parser.add_argument(
+        "--host",
+        default="127.0.0.1",
+        help="Address to listen on (default: 127.0.0.1)"
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8765,
+        help="Port to listen on (default: 8765)"
+    )
+    parser.add_argument(
+        "--quiet",
+        action="store_true",
+        help="Do not log every request"
+    )
+    args = parser.parse_args()
+
+    serve(args.host, args.port, args.quiet)
@@ -1,6 +1,17 @@
+import argparse
+import difflib
+import heapq
+import itertools
+import numpy as np
+import os
 import pandas as pd
+import pickle
 import re
+import tempfile
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from generateLabels import STANDARD_DTYPES, apply_unique, file_digest, internStrings
+from store import open_store, upsert_merged_labels
 
 TRACKING_AMT = 30
 
@@ -8,8 +19,53 @@ TRACKING_AMT = 30
 phone_model_df = pd.read_csv("PhoneModelMSDB.csv")
 phone_model_map = dict(zip(phone_model_df['Code'], phone_model_df['Model Info']))
 
-def has_two_hyphens(s):
-    return str(s).count('-') >= 2
+## Precompiled annotation patterns, one per code in lookup order. There are far more
+## codes than the re module caches, so compiling per call would recompile every label.
+phone_model_patterns = [
+    (code, model_info, re.compile(re.escape(code) + r'(?!\s*\()'))
+    for code, model_info in phone_model_map.items()
+]
+
+## Capacity map: Define the minimum capacity threshold for each package type
+capacity_map = {
+    'Small': 1,                  # Small = 1
+    'C5': 3,                     # Minimum for C5
+    'C4': 6,                     # Minimum for C4
+    'Parcel-Medium': 18,         # Minimum for Parcel-Medium
+    'Parcel-ExLarge': 36,        # Minimum for Parcel-ExLarge
+}
+capacity_map_tracked = {
+    'TMP-Small': 1,              # Same as Small
+    'TMP-C5': 3,                 # Same as C5
+    'TMP-Large': 12,              # Minimum for C4
+    'Parcel-Medium': 18,         # Same as Parcel-Medium
+    'Parcel-ExLarge': 36,        # Same as Parcel-ExLarge
+}
+capacity_map_express = {
+    'TMP-Express': 3,                # Same as C5
+    'Parcel-Express': 9         # Minimum for Parcel-Express
+}
+capacity_map_all = {
+    'small': 1,
+    'c5': 3,
+    'c4': 6,
+    'parcel-medium': 18,
+    'parcel-exlarge': 36,
+    'tmp-small': 1,
+    'tmp-c5': 3,
+    'tmp-large': 12,
+    'parcel-medium': 18,
+    'parcel-exLarge': 36,
+    'tmp-express': 3,
+    'parcel-express': 36
+}
+
+## Ladders mergePackaging picks the final envelope from, as (names, minimum capacities)
+## arrays. Index 0 is the default ladder, 1 is tracked and 2 is express.
+capacity_ladders = [
+    (np.array([''] + list(ladder.keys()), dtype=object), np.array(list(ladder.values())))
+    for ladder in (capacity_map, capacity_map_tracked, capacity_map_express)
+]
 
 def is_sd(s):
     return bool(re.findall(r'z\d', s))
@@ -80,40 +136,6 @@ def mergePackaging(packagingDict):
         if int(value) == 1:
             return key
     
-    # Capacity map: Define the minimum capacity threshold for each package type
-    capacity_map = {
-        'Small': 1,                  # Small = 1
-        'C5': 3,                     # Minimum for C5
-        'C4': 6,                     # Minimum for C4
-        'Parcel-Medium': 18,         # Minimum for Parcel-Medium
-        'Parcel-ExLarge': 36,        # Minimum for Parcel-ExLarge
-    }
-    capacity_map_tracked = {
-        'TMP-Small': 1,              # Same as Small
-        'TMP-C5': 3,                 # Same as C5
-        'TMP-Large': 12,              # Minimum for C4
-        'Parcel-Medium': 18,         # Same as Parcel-Medium
-        'Parcel-ExLarge': 36,        # Same as Parcel-ExLarge
-    }
-    capacity_map_express = {
-        'TMP-Express': 3,                # Same as C5
-        'Parcel-Express': 9         # Minimum for Parcel-Express
-    }
-    capacity_map_all = {
-        'small': 1,
-        'c5': 3,
-        'c4': 6,
-        'parcel-medium': 18,
-        'parcel-exlarge': 36,
-        'tmp-small': 1,
-        'tmp-c5': 3,
-        'tmp-large': 12,
-        'parcel-medium': 18,
-        'parcel-exLarge': 36,
-        'tmp-express': 3,
-        'parcel-express': 36
-    }
-
     cap_map = capacity_map
     #when we get an input, we multiply and get min capacity needed
     total_capacity = 0
@@ -139,6 +161,66 @@ def mergePackaging(packagingDict):
             return previous_envelope
     return previous_envelope
 
+def mergePackagingBatch(packagingDicts):
+    """
+    Same result as mergePackaging, computed for every merged row in one go.
+
+    The dictionaries are exploded into a long (row, envelope, count) table, capacities
+    are looked up per distinct envelope name and summed per row, and the envelope is
+    picked from the row's capacity ladder with searchsorted.
+
+    Parameters:
+        packagingDicts (list): One {envelope: count} dictionary per merged row.
+
+    Returns:
+        np.ndarray: The most suitable envelope size for each row.
+    """
+    rows, envelopes, counts = [], [], []
+    for row, packagingDict in enumerate(packagingDicts):
+        for envelope, number in packagingDict.items():
+            rows.append(row)
+            envelopes.append(envelope)
+            counts.append(number)
+
+    row_count = len(packagingDicts)
+    rows = np.array(rows, dtype=np.int64)
+    envelopes = pd.Series(envelopes, dtype=object)
+    counts = np.array(counts, dtype=np.int64)
+
+    # Capacity of each entry, NaN for '?' and unknown envelopes
+    codes, uniques = pd.factorize(envelopes.str.lower())
+    capacities = uniques.map(capacity_map_all).to_numpy(dtype=float)[codes]
+    total_capacity = np.bincount(rows, weights=np.nan_to_num(capacities) * counts, minlength=row_count)
+
+    # The last express/tracked envelope in the label decides the ladder, like in mergePackaging
+    ladder = np.select(
+        [envelopes.str.contains('Express', regex=False),
+         envelopes.str.contains('TMP', regex=False) | envelopes.str.contains('Parcel', regex=False)],
+        [2, 1],
+        default=-1
+    )
+    row_ladder = np.zeros(row_count, dtype=np.int64)
+    upgraded = pd.Series(ladder[ladder >= 0]).groupby(rows[ladder >= 0]).last()
+    row_ladder[upgraded.index] = upgraded.to_numpy()
+
+    result = np.full(row_count, '', dtype=object)
+    for ladder_id, (names, minimums) in enumerate(capacity_ladders):
+        picks = names[np.searchsorted(minimums, total_capacity, side='right')]
+        result = np.where(row_ladder == ladder_id, picks, result)
+
+    # The first '?' or unrecognised envelope in a label wins
+    invalid = np.flatnonzero(np.isnan(capacities))
+    invalid = invalid[np.unique(rows[invalid], return_index=True)[1]]
+    result[rows[invalid]] = [
+        "?" if envelope == "?" else "Error:" + envelope for envelope in envelopes.to_numpy()[invalid]
+    ]
+
+    ## why process when only 1 item
+    single = (np.bincount(rows, minlength=row_count)[rows] == 1) & (counts == 1)
+    result[rows[single]] = envelopes.to_numpy()[single]
+
+    return result
+
 def extractItems(label):
     cleaned_label = re.sub(r'\[.*?\]/\[.*?\]', '', label).replace(' ','').replace(',',', ')
     return cleaned_label.strip()
@@ -162,7 +244,7 @@ def isNormalDelivery(string):
     return True
 
 def dumbPackaging(items):
-    cableList = read_cable_codes('cables.csv')
+    cableList = cable_codes
     # print(items)
     itemList = items.split(', ')
     count = 0
@@ -197,6 +279,24 @@ def smartPackaging(label):
     allPackaging = parseLabelCounts(label)
     allItems = extractItems(label)
     finalPackaging = mergePackaging(allPackaging)
+    return packagingLabel(platform, finalPackaging, allItems)
+
+def smartPackagingBatch(labels):
+    """
+    smartPackaging for a whole column of merged labels, with the envelope choice
+    done by mergePackagingBatch instead of one mergePackaging call per label.
+    """
+    platforms = labels.str.extract(r'\[(.*?)\]', expand=False).fillna('?')
+    allPackaging = [parseLabelCounts(label) for label in labels]
+    allItems = [extractItems(label) for label in labels]
+    finalPackaging = mergePackagingBatch(allPackaging)
+    return pd.Series(
+        [packagingLabel(*parts) for parts in zip(platforms, finalPackaging, allItems)],
+        index=labels.index,
+        dtype=object
+    )
+
+def packagingLabel(platform, finalPackaging, allItems):
     hardPackaging = dumbPackaging(allItems)
     if (hardPackaging != None and isNormalDelivery(finalPackaging)):
         # override smart packaging for cables
@@ -250,14 +350,11 @@ def annotate_phone_model(label):
     ## extract brackets here
     brackets = extract_bracket(label)
     updated_label = extractItems(label)
-    for code, model_info in phone_model_map.items():
-        # Match the code as a whole word or segment
-        pattern = re.escape(code)
+    for code, model_info, pattern in phone_model_patterns:
         # Append model info if code present but not already annotated
-        if re.search(pattern, updated_label) and model_info not in updated_label:
-            updated_label = re.sub(
-                pattern + r'(?!\s*\()',  # only if not already followed by a parenthesis
-                f"{code} ({model_info})",updated_label
+        if code in updated_label and model_info not in updated_label:
+            updated_label = pattern.sub(  # only if not already followed by a parenthesis
+                f"{code} ({model_info})", updated_label
             )
 
     if brackets:
@@ -265,11 +362,20 @@ def annotate_phone_model(label):
     else:
         return updated_label
 
+def sort_string(label):
+    """
+    The items part of a finished label without spaces, what the picking order sorts on.
+    """
+    return label.split(']')[-1].replace(" ", "") or "???"
+
 def read_cable_codes(file_path):
     df = pd.read_csv(file_path)
     data_array = df.iloc[:, 0].tolist()
     return data_array
 
+## Cable lookup, loaded once instead of once per label
+cable_codes = set(read_cable_codes('cables.csv'))
+
 def fill_missing_details(df):
     """
     Fills missing details for rows without an address or rname by propagating
@@ -300,40 +406,84 @@ def nullify_summary_parent(group):
         group.loc[max_amt_idx, 'Quantity'] = 0
     return group
 
-def merge_orders(input_csv, output_csv):
+def join_sorted_per_group(values, group_number, group_count, unique=False):
     """
-    Reads the standardized CSV file, fills missing details, merges rows based on the merging rules,
-    and saves the result to a new CSV.
+    Vectorized equivalent of ', '.join(sorted(x.dropna())) for every group at once.
+    Values are sorted a single time for the whole table, so each group only has to
+    concatenate an already ordered run of strings.
 
     Parameters:
-        input_csv (str): The input CSV file path.
-        output_csv (str): The output CSV file path.
+        values (pd.Series): The column to combine.
+        group_number (pd.Series): Group number of every row, as given by GroupBy.ngroup().
+        group_count (int): Number of groups, groups without any values get ''.
+        unique (bool): Drop repeated values within a group first.
+
+    Returns:
+        np.ndarray: The combined string for each group, in group number order.
     """
-    # Read the standardized CSV file
-    df = pd.read_csv(input_csv)
+    pairs = pd.DataFrame({'group': group_number, 'value': values}).dropna(subset=['value'])
+    if unique:
+        pairs = pairs.drop_duplicates()
+    pairs = pairs.sort_values(['group', 'value'])
+    joined = pairs.groupby('group', sort=True)['value'].agg(', '.join)
+    return joined.reindex(range(group_count), fill_value='').to_numpy()
 
+def read_standardized(input_csv):
+    """
+    Reads the standardized CSV file, keeping the compact schema from generateLabels.py.
+    """
+    return clean_standardized(pd.read_csv(input_csv, dtype=STANDARD_DTYPES))
+
+def clean_standardized(df):
     # Clean whitespace in key columns
     df['address'] = df['address'].str.strip()
-    df['custom_label'] = df['custom_label'].str.strip()
+    df['custom_label'] = internStrings(df['custom_label'].str.strip())
     df['id'] = df['id'].str.strip()
     df['rname'] = df['rname'].str.strip()
+    return df
+
+def merge_frame(df, fuzzy_addresses=False):
+    """
+    Fills missing details, merges rows based on the merging rules and builds the final
+    labels. The merged rows come back in group order, use sort_merged to order them.
+
+    Parameters:
+        df (pd.DataFrame): Standardized orders, as returned by read_standardized.
+        fuzzy_addresses (bool): Also merge near-duplicate addresses (see unify_addresses).
+
+    Returns:
+        pd.DataFrame: One row per merged parcel.
+    """
+    df = prepare_orders(df)
+    if fuzzy_addresses:
+        df = unify_addresses(df)
+    return merge_groups(df)
 
+def prepare_orders(df):
+    """
+    The per-order steps of the merge: fills missing details and zeroes eBay summary rows.
+    Rows come back ordered by id.
+    """
     # Handle missing details (eBay-style orders)
     df = (
         df.sort_values(['id', 'address'])
-        .groupby(['source_platform'], group_keys=False)
+        .groupby(['source_platform'], group_keys=False, observed=True)
         .apply(fill_missing_details)
     )
 
-    df = df.groupby('id', group_keys=False).apply(nullify_summary_parent)
+    return df.groupby('id', group_keys=False).apply(nullify_summary_parent)
 
+def merge_groups(df):
+    """
+    The per-parcel steps of the merge: combines rows sharing an address, recipient and
+    platform, then works out packaging and builds the readable label.
+    """
     # Merge logic:
     # Group by address, recipient (rname), and source_platform
+    grouped = df.groupby(['address', 'rname', 'source_platform'], dropna=False, observed=True)
+    group_number = grouped.ngroup()
     merged_df = (
-        df.groupby(['address', 'rname', 'source_platform'], dropna=False)
-        .agg({
-            'id': lambda x: ', '.join(sorted(x.dropna().unique())),  # Combine unique IDs
-            'custom_label': lambda x: ', '.join(sorted(x.dropna())),  # Combine custom labels
+        grouped.agg({
             'city': 'first',  # Keep the first city
             'zip': 'first',  # Keep the first zip
             'state': 'first',  # Keep the first state
@@ -342,26 +492,53 @@ def merge_orders(input_csv, output_csv):
         })
         .reset_index()
     )
+    merged_df['id'] = join_sorted_per_group(df['id'], group_number, len(merged_df), unique=True)  # Combine unique IDs
+    merged_df['custom_label'] = join_sorted_per_group(df['custom_label'], group_number, len(merged_df))  # Combine custom labels
 
     # Smart Packaging calculation
-    merged_df['custom_label'] = merged_df['custom_label'].astype(str).apply(lambda x: smartPackaging(x)) 
+    merged_df['custom_label'] = smartPackagingBatch(merged_df['custom_label'].astype(str))
 
     merged_df['custom_label'] = merged_df.apply(lambda row: amt_packaging_update(row['custom_label'], row['amt']), axis=1)
     
     # Final touches to make label readable
-    merged_df['custom_label'] = merged_df['custom_label'].astype(str).apply(lambda x: finishUpLabel(x)) 
+    merged_df['custom_label'] = apply_unique(finishUpLabel, merged_df['custom_label'].astype(str))
 
     # Final touches to annotate label with phone models
-    merged_df['custom_label'] = merged_df['custom_label'].astype(str).apply(lambda x: annotate_phone_model(x)) 
+    merged_df['custom_label'] = apply_unique(annotate_phone_model, merged_df['custom_label'].astype(str))
 
     # Prepare for Sorting with custom order
-    merged_df['sort'] = merged_df['custom_label'].str.split(']').str[-1].str.replace(" ", "", regex=True)
-    merged_df['sort'] = merged_df['sort'].fillna("???").replace("", "???")
+    merged_df['sort'] = apply_unique(sort_string, merged_df['custom_label'])
+    return merged_df
+
+def merge_parcel(custom_labels, amt):
+    """
+    merge_groups for a single parcel in plain Python, for callers that need one label
+    quickly (see label_service.py) rather than a whole day's orders.
 
+    Parameters:
+        custom_labels (list): Standardized custom_label of every order line on the parcel.
+        amt (float): Total amount of the parcel.
+
+    Returns:
+        tuple: (custom_label, sort) as merge_groups would give them.
+    """
+    labels = sorted(label.strip() for label in custom_labels if isinstance(label, str) and label.strip())
+    label = smartPackaging(', '.join(labels))
+    label = amt_packaging_update(label, amt)
+    label = annotate_phone_model(finishUpLabel(label))
+    return label, sort_string(label)
+
+def sort_merged(merged_df):
+    """
+    Orders the merged rows for picking and keeps only the output columns.
+    """
     # Apply sorting rules:
     # - Items with at least two '-' are sorted alphabetically.
     # - Items without at least two '-' (including empty strings or NaNs) are placed at the end.
-    merged_df['sort_key'] = merged_df['sort'].apply(lambda x: (0, x) if has_two_hyphens(x) else (1, x))
+    # The hyphen flag is prefixed onto the sort string ('0' sorts before '1'), which compares
+    # exactly like the old (0, x)/(1, x) tuples, so rows that tie keep the same order as before.
+    has_two_hyphens = merged_df['sort'].str.count('-') >= 2
+    merged_df['sort_key'] = has_two_hyphens.map({True: '0', False: '1'}) + merged_df['sort']
 
     # Sort the DataFrame based on the defined sort key
     merged_df = merged_df.sort_values(by='sort_key')
@@ -373,15 +550,505 @@ def merge_orders(input_csv, output_csv):
     column_order = ['id', 'rname', 'address', 'city', 'state', 'zip', 'custom_label', 'Quantity', 'sort', 'amt']
     merged_df = merged_df[column_order]
 
-    merged_df = merged_df.drop(columns=['Quantity'])
+    return merged_df.drop(columns=['Quantity'])
+
+def shard_by_postcode(df, shard_count):
+    """
+    Hash-partitions the standardized table by postcode so every shard can be merged on its own.
+    Rows that merge always share a postcode, and all rows of an id go to the shard of the id's
+    first addressed row, so the eBay fill step still sees the whole order.
+
+    Returns:
+        list: The non-empty shards.
+    """
+    first_zip = df.sort_values(['id', 'address']).groupby('id', sort=False)['zip'].first()
+    postcode = df['id'].map(first_zip).fillna(df['zip']).fillna(0).astype('int64')
+    shard = pd.util.hash_array(postcode.to_numpy()) % shard_count
+    return [part for _, part in df.groupby(shard)]
+
+def merge_sharded(df, workers, fuzzy_addresses=False):
+    """
+    Runs merge_frame on postcode shards in worker processes. The result is in the same
+    group order as merge_frame on the whole table, so sort_merged gives identical output.
+    """
+    shards = shard_by_postcode(df, workers)
+    if len(shards) < 2:
+        return merge_frame(df, fuzzy_addresses)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        merged_shards = list(executor.map(merge_frame, shards, itertools.repeat(fuzzy_addresses)))
+
+    merged_df = pd.concat(merged_shards, ignore_index=True)
+    return merged_df.sort_values(['address', 'rname', 'source_platform'], kind='stable', ignore_index=True)
+
+# =========================
+# Fuzzy address matching
+# =========================
+
+STREET_SUFFIXES = {
+    'street': 'st', 'road': 'rd', 'avenue': 'ave', 'av': 'ave', 'drive': 'dr', 'court': 'ct',
+    'place': 'pl', 'crescent': 'cres', 'cr': 'cres', 'lane': 'ln', 'parade': 'pde',
+    'highway': 'hwy', 'close': 'cl', 'terrace': 'tce', 'boulevard': 'blvd', 'grove': 'gr',
+    'circuit': 'cct', 'square': 'sq', 'way': 'wy',
+}
+# "Unit 3 12 ...", "Apt 3, 12 ..." and "U3 12 ..." are all written "3/12 ..."
+UNIT_PATTERN = re.compile(r'\b(?:unit|u|apt|apartment|flat|shop)\s*(\d+[a-z]?)\s+(\d+[a-z]?)\b')
+ADDRESS_PUNCTUATION = re.compile(r'[^\w/ ]+')
+HOUSE_NUMBER_PATTERN = re.compile(r'(?:^|\s)(?:(\d+[a-z]?)/)?(\d+[a-z]?)\s+[a-z]')
+# Units written after the street, eg. "12 smith st apt 3"
+TRAILING_UNIT_PATTERN = re.compile(r'\b(?:unit|u|apt|apartment|flat|shop)\s*(\d+[a-z]?)\b')
+FUZZY_ADDRESS_THRESHOLD = 0.9
+
+def canonical_address(address):
+    """
+    Lower-cased address with punctuation dropped, unit notation unified and street
+    suffixes abbreviated, eg. "Unit 3, 12 Smith Street" -> "3/12 smith st".
+    """
+    text = ' '.join(ADDRESS_PUNCTUATION.sub(' ', str(address).lower()).split())
+    text = UNIT_PATTERN.sub(r'\1/\2', text)
+    return ' '.join(STREET_SUFFIXES.get(token, token) for token in text.split())
+
+def house_number(canonical):
+    """
+    The street number right before the street name with its unit, or None, eg. "3/12" for
+    both "3/12 smith st" and "12 smith st apt 3". "12a" stays apart from "12".
+    """
+    match = HOUSE_NUMBER_PATTERN.search(canonical)
+    if not match:
+        return None
+    unit, number = match.groups()
+    if unit is None:
+        trailing = TRAILING_UNIT_PATTERN.search(canonical, match.end())
+        unit = trailing.group(1) if trailing else None
+    return f"{unit}/{number}" if unit else number
+
+def cluster_similar(values, threshold):
+    """
+    Union-find over the values of one block: values whose difflib ratio reaches the
+    threshold end up in the same cluster. Returns {value: cluster root}.
+    """
+    parent = {value: value for value in values}
+
+    def root(value):
+        while parent[value] != value:
+            parent[value] = parent[parent[value]]
+            value = parent[value]
+        return value
+
+    for a, b in itertools.combinations(values, 2):
+        if root(a) != root(b) and difflib.SequenceMatcher(None, a, b).ratio() >= threshold:
+            parent[root(b)] = root(a)
+    return {value: root(value) for value in values}
+
+def unify_addresses(df, threshold=FUZZY_ADDRESS_THRESHOLD):
+    """
+    Rewrites near-duplicate addresses of the same recipient to one spelling so merge_groups
+    combines them ("12 Smith St" and "12 Smith Street" become one parcel).
+
+    Orders are blocked by platform, recipient, postcode and house and unit number, and
+    addresses are only compared within a block (so different units are never merged), so the cost stays close to linear on large days. Every
+    cluster takes its most common spelling (and recipient name) as written on the orders.
+    """
+    original_index = df.index  # prepare_orders leaves repeated labels, work by position
+    df = df.reset_index(drop=True)
+
+    addressed = df['address'].notna() & df['rname'].notna()
+    unique_addresses = pd.Series(df.loc[addressed, 'address'].unique())
+    canonical = dict(zip(unique_addresses, unique_addresses.map(canonical_address)))
+
+    rows = df.loc[addressed, ['address', 'rname', 'zip', 'source_platform']].copy()
+    rows['canonical'] = rows['address'].map(canonical)
+    rows['house'] = rows['canonical'].map(house_number)
+    rows['recipient'] = rows['rname'].str.lower().str.split().str.join(' ')
+    rows = rows[rows['house'].notna()]
+
+    blocks = rows.groupby(['source_platform', 'recipient', 'zip', 'house'], observed=True, sort=False)
+    cluster = pd.Series(index=rows.index, dtype=object)
+    for block_key, block in blocks:
+        spellings = block['canonical'].unique()
+        if len(spellings) == 1 and block['address'].nunique() == 1 and block['rname'].nunique() == 1:
+            continue
+        roots = cluster_similar(sorted(spellings), threshold)
+        cluster[block.index] = [block_key + (roots[c],) for c in block['canonical']]
+
+    clustered = rows.loc[cluster.notna(), ['address', 'rname']].assign(cluster=cluster.dropna())
+    if clustered.empty:
+        return df.set_axis(original_index)
+
+    # Most common spelling first, ties broken alphabetically so reruns pick the same one
+    spelling = (
+        clustered.groupby(['cluster', 'address', 'rname']).size().rename('n').reset_index()
+        .sort_values(['n', 'address', 'rname'], ascending=[False, True, True])
+        .drop_duplicates('cluster').set_index('cluster')
+    )
+    df.loc[clustered.index, 'address'] = clustered['cluster'].map(spelling['address'])
+    df.loc[clustered.index, 'rname'] = clustered['cluster'].map(spelling['rname'])
+    return df.set_axis(original_index)
+
+# =========================
+# Out-of-core merge
+# =========================
+
+MERGED_COLUMNS = ['id', 'rname', 'address', 'city', 'state', 'zip', 'custom_label', 'sort', 'amt']
+# The standardized columns the merge reads, with fixed types so every chunk parses the same way
+MERGE_INPUT_DTYPES = {
+    **STANDARD_DTYPES,
+    'id': str, 'rname': str, 'address': str, 'custom_label': str,
+    'Quantity': 'float64', 'amt': 'float64',
+}
+RUN_BLOCK_ROWS = 2048
+
+def _missing_last(value):
+    """Sort key part that orders strings normally and puts missing values last, like pandas."""
+    missing = not isinstance(value, str)
+    return (missing, '' if missing else value)
+
+def _write_run(records, tmp_dir):
+    handle, path = tempfile.mkstemp(suffix='.run', dir=tmp_dir)
+    with os.fdopen(handle, 'wb') as f:
+        for start in range(0, len(records), RUN_BLOCK_ROWS):
+            pickle.dump(records[start:start + RUN_BLOCK_ROWS], f, pickle.HIGHEST_PROTOCOL)
+    return path
+
+def _read_run(path):
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                block = pickle.load(f)
+            except EOFError:
+                return
+            yield from block
+
+def external_sort(records, key, run_rows, tmp_dir):
+    """
+    Yields records ordered by key. Records are buffered up to run_rows at a time, each full
+    buffer is sorted and spilled to tmp_dir, and the runs are k-way merged at the end.
+    Records with equal keys keep their input order.
+    """
+    runs = []
+    buffer = []
+    for record in records:
+        buffer.append(record)
+        if len(buffer) >= run_rows:
+            buffer.sort(key=key)
+            runs.append(_write_run(buffer, tmp_dir))
+            buffer = []
+    buffer.sort(key=key)
+
+    if not runs:
+        yield from buffer
+        return
+    if buffer:
+        runs.append(_write_run(buffer, tmp_dir))
+        buffer = []
+    yield from heapq.merge(*(_read_run(path) for path in runs), key=key)
+
+def _blocks(records):
+    block = list(itertools.islice(records, RUN_BLOCK_ROWS))
+    while block:
+        yield block
+        block = list(itertools.islice(records, RUN_BLOCK_ROWS))
+
+def _batches_by_key(records, key, batch_rows):
+    """
+    Groups an ordered record stream into lists of at least batch_rows records, only
+    splitting between keys so a batch always holds every record of a key.
+    """
+    batch = []
+    for _, group in itertools.groupby(records, key=key):
+        batch.extend(group)
+        if len(batch) >= batch_rows:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def merge_orders_external(input_csv, output_csv, memory_budget_mb=256, tmp_dir=None):
+    """
+    Same merge as merge_orders for standardized files larger than memory.
+
+    Rows are external-sorted by order id to fill missing details, external-sorted again by
+    (address, rname, source_platform) and streamed through merge_groups a batch of whole
+    groups at a time. The merged rows are sorted one last time on disk and written out
+    incrementally. Rows with identical items keep their group order, which may differ from
+    the order merge_orders gives those ties.
+
+    Parameters:
+        input_csv (str): The input CSV file path.
+        output_csv (str): The output CSV file path.
+        memory_budget_mb (int): Rough cap on the memory used for buffered rows.
+        tmp_dir (str): Where sorted runs are spilled, defaults to the system temp folder.
+    """
+    budget = memory_budget_mb * 1024 * 1024
+
+    read_options = {'usecols': list(MERGE_INPUT_DTYPES), 'dtype': MERGE_INPUT_DTYPES}
+
+    # Size the runs from the first rows of the file
+    sample = clean_standardized(pd.read_csv(input_csv, nrows=1000, **read_options))
+    columns = list(sample.columns)
+    # Text columns stay as objects when rebuilding frames, astype(str) would turn NaN into 'nan'
+    dtypes = {column: MERGE_INPUT_DTYPES[column] for column in columns if MERGE_INPUT_DTYPES[column] is not str}
+    row_bytes = max(1, int(sample.memory_usage(deep=True).sum() / max(1, len(sample))))
+    # Python tuples cost several times the DataFrame size, and runs, batches and frames overlap
+    run_rows = max(1000, budget // (row_bytes * 8))
+
+    position = {column: index for index, column in enumerate(columns)}
+    platform_i, id_i, address_i, rname_i = (position[c] for c in ['source_platform', 'id', 'address', 'rname'])
+
+    def read_records():
+        for chunk in pd.read_csv(input_csv, chunksize=run_rows, **read_options):
+            chunk = clean_standardized(chunk)
+            # Orders without an id are dropped by the per-order step of merge_orders as well
+            chunk = chunk[chunk['id'].notna()]
+            yield from chunk.astype(object).itertuples(index=False, name=None)
+
+    def to_frame(records):
+        return pd.DataFrame.from_records(records, columns=columns).astype(dtypes)
+
+    with tempfile.TemporaryDirectory(prefix='merge_runs_', dir=tmp_dir) as spill_dir:
+        # 1. Whole orders together, in the order merge_orders fills them
+        by_order = external_sort(
+            (record + (row,) for row, record in enumerate(read_records())),
+            key=lambda r: (r[platform_i], r[id_i], _missing_last(r[address_i]), r[-1]),
+            run_rows=run_rows,
+            tmp_dir=spill_dir
+        )
+
+        def prepared_records():
+            sequence = itertools.count()
+            for batch in _batches_by_key(by_order, lambda r: (r[platform_i], r[id_i]), run_rows):
+                prepared = prepare_orders(to_frame([r[:-1] for r in batch]))
+                for record in prepared.astype(object).itertuples(index=False, name=None):
+                    yield record + (next(sequence),)
+
+        # 2. Whole parcels together, in group order
+        def group_key(r):
+            return (_missing_last(r[address_i]), _missing_last(r[rname_i]), r[platform_i])
+
+        by_group = external_sort(
+            prepared_records(),
+            key=lambda r: group_key(r) + (r[id_i], r[-1]),
+            run_rows=run_rows,
+            tmp_dir=spill_dir
+        )
+
+        def merged_records():
+            sequence = itertools.count()
+            for batch in _batches_by_key(by_group, group_key, run_rows):
+                merged = merge_groups(to_frame([r[:-1] for r in batch]))
+                has_two_hyphens = merged['sort'].str.count('-') >= 2
+                sort_key = has_two_hyphens.map({True: '0', False: '1'}) + merged['sort']
+                for key, record in zip(sort_key, merged[MERGED_COLUMNS].astype(object).itertuples(index=False, name=None)):
+                    yield (key, next(sequence)) + record
+
+        # 3. Final picking order, written as it streams off the merge
+        output_dtypes = {'zip': dtypes['zip'], 'amt': dtypes['amt']}
+        written = 0
+        with open(output_csv, 'w', newline='', encoding='utf-8') as f:
+            pd.DataFrame(columns=MERGED_COLUMNS).to_csv(f, index=False)
+            ordered = external_sort(merged_records(), key=lambda r: r[:2], run_rows=run_rows, tmp_dir=spill_dir)
+            for batch in _blocks(ordered):
+                frame = pd.DataFrame.from_records([r[2:] for r in batch], columns=MERGED_COLUMNS).astype(output_dtypes)
+                frame.to_csv(f, index=False, header=False)
+                written += len(frame)
+
+    print(f"Merged data has been saved to: {output_csv} ({written} rows)")
+
+# =========================
+# Incremental merge
+# =========================
+
+GROUP_COLUMNS = ['address', 'rname', 'source_platform']
+LEDGER_FORMAT = 2
+
+## Any edit to this file or to the phone model and cable lists starts the ledger over,
+## so reused parcels never outlive the code and lookups that made them
+LEDGER_VERSION = f"{LEDGER_FORMAT}:" + ':'.join(
+    file_digest(path)[:16] for path in (__file__, 'PhoneModelMSDB.csv', 'cables.csv')
+)
+
+def order_hashes(df):
+    """
+    One content hash per order id over all of its standardized rows, in file order.
+    Rows without an id are left out, as the full merge drops them too.
+    """
+    df = df[df['id'].notna()]
+    row_hash = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    position = df.groupby('id', sort=False).cumcount().to_numpy().astype('uint64')
+    mixed = pd.util.hash_array(row_hash + position)
+    return pd.Series(mixed, index=df.index).groupby(df['id'], sort=False).sum()
+
+def group_keys(df):
+    """
+    A single comparable string per (address, rname, source_platform), missing values included.
+    """
+    return df['address'].astype(str) + '\x1f' + df['rname'].astype(str) + '\x1f' + df['source_platform'].astype(str)
+
+def load_ledger(ledger_path):
+    if not os.path.exists(ledger_path):
+        return None
+    with open(ledger_path, 'rb') as f:
+        ledger = pickle.load(f)
+    return ledger if ledger.get('version') == LEDGER_VERSION else None
+
+def save_ledger(ledger_path, hashes, members, merged_df):
+    tmp_path = ledger_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump({'version': LEDGER_VERSION, 'hashes': hashes, 'members': members, 'merged': merged_df},
+                    f, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, ledger_path)
+
+def merge_incremental(df, ledger):
+    """
+    Re-merges only the parcels touched by new, changed or removed orders.
+
+    An order's rows are prepared on their own, so an unchanged order keeps the parcels it
+    had last run. Every parcel a new or changed order lands in, or an old version of it
+    left, is rebuilt from all current rows that belong to it, including orders from
+    earlier runs at the same address. All other parcels are reused from the ledger.
+
+    Parameters:
+        df (pd.DataFrame): Standardized orders, as returned by read_standardized.
+        ledger (dict): The previous run's ledger, or None to merge everything.
+
+    Returns:
+        tuple: (merged rows in group order, order hashes, order → parcel members, rebuilt parcel count)
+    """
+    hashes = order_hashes(df)
+    if ledger is None:
+        prepared = prepare_orders(df)
+        merged_df = merge_groups(prepared)
+        members = pd.DataFrame({'id': prepared['id'], 'key': group_keys(prepared)}).drop_duplicates()
+        return merged_df, hashes, members, len(merged_df)
+
+    old_hashes, old_members, old_merged = ledger['hashes'], ledger['members'], ledger['merged']
+    changed = hashes.index[~hashes.index.isin(old_hashes.index) | (hashes != old_hashes.reindex(hashes.index)).to_numpy()]
+    removed = old_hashes.index[~old_hashes.index.isin(hashes.index)]
+
+    changed_rows = prepare_orders(df[df['id'].isin(changed)])
+    affected_keys = set(group_keys(changed_rows)) | set(old_members.loc[old_members['id'].isin(changed.union(removed)), 'key'])
+
+    # Unchanged orders sharing a parcel with the delta are re-prepared and merged back in.
+    # Preparing them together with the delta keeps the row order (and so the amount sums)
+    # exactly as a full merge would have them.
+    kept_members = old_members[~old_members['id'].isin(changed.union(removed))]
+    neighbours = kept_members.loc[kept_members['key'].isin(affected_keys), 'id'].unique()
+    rows = prepare_orders(df[df['id'].isin(changed.union(neighbours))]) if len(neighbours) else changed_rows
+    rows = rows[group_keys(rows).isin(affected_keys)]
+
+    rebuilt = merge_groups(rows) if len(rows) else old_merged.iloc[:0]
+    kept = old_merged[~group_keys(old_merged).isin(affected_keys)]
+    merged_df = pd.concat([kept, rebuilt], ignore_index=True)
+    merged_df = merged_df.sort_values(GROUP_COLUMNS, kind='stable', ignore_index=True)
+
+    members = pd.concat([
+        kept_members,
+        pd.DataFrame({'id': changed_rows['id'], 'key': group_keys(changed_rows)}).drop_duplicates()
+    ], ignore_index=True)
+    return merged_df, hashes, members, len(rebuilt)
+
+def merge_orders_incremental(input_csv, output_csv, ledger_path='merge_ledger.pkl'):
+    """
+    Same output as merge_orders, but reuses the parcels of orders already merged on a
+    previous run. The ledger keeps each order's content hash, the parcels it belongs to and
+    the merged rows, and is rewritten after every run.
+
+    Parameters:
+        input_csv (str): The input CSV file path.
+        output_csv (str): The output CSV file path.
+        ledger_path (str): Where the ledger is kept between runs.
+    """
+    df = read_standardized(input_csv)
+    merged_df, hashes, members, rebuilt = merge_incremental(df, load_ledger(ledger_path))
+    save_ledger(ledger_path, hashes, members, merged_df)
+
+    sort_merged(merged_df.copy()).to_csv(output_csv, index=False)
+    print(f"Merged data has been saved to: {output_csv} ({rebuilt} of {len(merged_df)} labels rebuilt)")
+
+def merge_orders(input_csv, output_csv, workers=1, fuzzy_addresses=False):
+    """
+    Reads the standardized CSV file, fills missing details, merges rows based on the merging rules,
+    and saves the result to a new CSV.
+
+    Parameters:
+        input_csv (str): The input CSV file path.
+        output_csv (str): The output CSV file path.
+        workers (int): Number of processes to merge postcode shards with, 1 merges in-process.
+        fuzzy_addresses (bool): Also merge near-duplicate addresses of the same recipient.
+    """
+    df = read_standardized(input_csv)
+
+    if workers > 1:
+        merged_df = merge_sharded(df, workers, fuzzy_addresses)
+    else:
+        merged_df = merge_frame(df, fuzzy_addresses)
+
+    merged_df = sort_merged(merged_df)
 
     # Save the merged DataFrame to the output CSV file
     merged_df.to_csv(output_csv, index=False)
     print(f"Merged data has been saved to: {output_csv}")
 
 
-# Call the function with the output of the first part
-input_csv = 'standardized_columns.csv'  # Input file from the first part
-output_csv = 'merged_labels.csv'  # Output file after merging
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Merge standardized orders into packing labels.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Merge postcode shards in this many processes (default: 1)"
+    )
+    parser.add_argument(
+        "--external",
+        action="store_true",
+        help="Merge with on-disk sorting, for standardized files larger than memory"
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=int,
+        default=256,
+        help="Approximate memory in MB the --external merge may buffer (default: 256)"
+    )
+    parser.add_argument(
+        "--tmp-dir",
+        default=None,
+        help="Folder for the --external merge's temporary files (default: system temp)"
+    )
+    parser.add_argument(
+        "--fuzzy-addresses",
+        action="store_true",
+        help="Also merge near-duplicate addresses of the same recipient (eg. 12 Smith St / 12 Smith Street)"
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only re-merge labels touched by new or changed orders since the last --incremental run"
+    )
+    parser.add_argument(
+        "--ledger",
+        default='merge_ledger.pkl',
+        help="Ledger file the --incremental merge keeps between runs (default: merge_ledger.pkl)"
+    )
+    parser.add_argument(
+        "--store",
+        default=None,
+        help="SQLite order store to upsert the merged labels into (see store.py)"
+    )
+    args = parser.parse_args()
+    if args.incremental and (args.workers != 1 or args.external or args.fuzzy_addresses):
+        parser.error("--incremental cannot be combined with --workers, --external or --fuzzy-addresses")
+
+    # Call the function with the output of the first part
+    input_csv = 'standardized_columns.csv'  # Input file from the first part
+    output_csv = 'merged_labels.csv'  # Output file after merging
+
+    if args.incremental:
+        merge_orders_incremental(input_csv, output_csv, args.ledger)
+    elif args.external:
+        merge_orders_external(input_csv, output_csv, args.memory_budget, args.tmp_dir)
+    else:
+        merge_orders(input_csv, output_csv, workers=args.workers, fuzzy_addresses=args.fuzzy_addresses)
 
-merge_orders(input_csv, output_csv)
+    if args.store:
+        stored = upsert_merged_labels(open_store(args.store), pd.read_csv(output_csv, dtype=str))
+        print(f"Stored {stored} merged labels in {args.store}")
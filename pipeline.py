@@ -0,0 +1,208 @@
+import argparse
+import fnmatch
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TODAY = datetime.now().strftime('%Y%m%d')
+
+
+class Stage:
+    """
+    One script run in the pipeline.
+
+    Parameters:
+        name (str): Name shown in the log and summary.
+        command (list): Script and arguments, run with the current Python from the project folder.
+        inputs (list): Files (or glob patterns) the stage reads, relative to the working folder.
+        outputs (list): Files the stage writes. The stage is skipped when all of them are newer than every input.
+        after (list): Stages that have to finish first.
+    """
+    def __init__(self, name, command, inputs, outputs, after=()):
+        self.name = name
+        self.command = command
+        self.inputs = inputs
+        self.outputs = outputs
+        self.after = list(after)
+
+
+def build_stages(warehouse=None, threshold=None, grid=None):
+    """
+    The full pipeline. Label stages are only included when a warehouse is given, as they
+    book real Sendle orders.
+    """
+    stages = [
+        Stage('standardize', ['generateLabels.py'], ['*_orders.csv'], ['standardized_columns.csv']),
+        Stage('merge', ['merge.py'], ['standardized_columns.csv', 'PhoneModelMSDB.csv', 'cables.csv'], ['merged_labels.csv'],
+              after=['standardize']),
+        Stage('kogan dispatch', ['dispatch.py', '--only', 'kogan'],
+              ['merged_labels.csv', 'kogan_orders.csv', 'tracking.csv'], ['koganDispatch.csv'],
+              after=['merge']),
+        Stage('ebay dispatch', ['dispatch.py', '--only', 'ebay'],
+              ['eBay_orders.csv', 'tracking.csv'], ['eBayDispatch.csv']),
+    ]
+
+    if warehouse:
+        labels = ['createLabels.py', '--warehouse', warehouse]
+        if threshold is not None:
+            labels += ['--threshold', str(threshold)]
+        if grid:
+            labels += ['--grid', grid]
+        stages += [
+            Stage('sendle orders', labels + ['--stage', 'orders'],
+                  ['sendle_batch_csv_template.csv'], ['basic_labels.csv', 'tracking_update.csv']),
+            Stage('basic labels', labels + ['--stage', 'basic'],
+                  ['basic_labels.csv'], [f'{TODAY}_basic.pdf'], after=['sendle orders']),
+            Stage('sendle combine', labels + ['--stage', 'combine'],
+                  ['tracking_update.csv'], [f'{TODAY}_sendle.pdf'], after=['sendle orders']),
+        ]
+    return stages
+
+
+def resolve(directory, patterns):
+    """
+    Expands the stage's file patterns. Returns (paths found, patterns with no match).
+    """
+    names = os.listdir(directory)
+    found, missing = [], []
+    for pattern in patterns:
+        # Exports come in with any capitalisation (eg. eBay_orders.csv vs ebay_orders.csv)
+        matches = [name for name in names if fnmatch.fnmatch(name.lower(), pattern.lower())]
+        if matches:
+            found += [os.path.join(directory, name) for name in matches]
+        else:
+            missing.append(pattern)
+    return found, missing
+
+
+def is_up_to_date(directory, stage):
+    inputs, missing_inputs = resolve(directory, stage.inputs)
+    outputs, missing_outputs = resolve(directory, stage.outputs)
+    if missing_outputs or missing_inputs:
+        return False
+    return min(os.path.getmtime(p) for p in outputs) >= max(os.path.getmtime(p) for p in inputs)
+
+
+def run_stage(directory, stage):
+    """
+    Runs the stage's script in its own process. Returns (return code, seconds, output).
+    """
+    script, *args = stage.command
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, os.path.join(BASE_DIR, script), *args],
+        cwd=directory, capture_output=True, text=True
+    )
+    return result.returncode, time.perf_counter() - started, result.stdout + result.stderr
+
+
+def run_pipeline(stages, directory='.', jobs=4, force=False, verbose=False):
+    """
+    Runs every stage once the stages it comes after have finished, as many at a time as
+    jobs allows. Stages whose outputs are newer than their inputs are skipped, and stages
+    after a failed one are not run.
+
+    Returns:
+        dict: {stage name: (status, seconds)}
+    """
+    by_name = {stage.name: stage for stage in stages}
+    results = {}
+    pending = list(stages)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        while pending or running:
+            for stage in list(pending):
+                states = [results.get(name, (None,))[0] for name in stage.after if name in by_name]
+                if None in states:
+                    continue
+                pending.remove(stage)
+
+                if any(state in ('failed', 'blocked') for state in states):
+                    results[stage.name] = ('blocked', 0.0)
+                elif resolve(directory, stage.inputs)[1]:
+                    print(f"[{stage.name}] skipped, missing {', '.join(resolve(directory, stage.inputs)[1])}")
+                    results[stage.name] = ('missing input', 0.0)
+                elif not force and is_up_to_date(directory, stage):
+                    print(f"[{stage.name}] up to date")
+                    results[stage.name] = ('up to date', 0.0)
+                else:
+                    print(f"[{stage.name}] started")
+                    running[executor.submit(run_stage, directory, stage)] = stage
+
+            if not running:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                code, seconds, output = future.result()
+                if verbose or code != 0:
+                    print(output.rstrip())
+                status = 'ok' if code == 0 else 'failed'
+                print(f"[{stage.name}] {status} in {seconds:.2f}s")
+                results[stage.name] = (status, seconds)
+
+    return results
+
+
+def print_summary(results, elapsed):
+    width = max(len(name) for name in results)
+    print("----------------------------------------------------------------")
+    for name, (status, seconds) in results.items():
+        print(f"{name.ljust(width)}  {status:<13} {seconds:7.2f}s")
+    print(f"{'total'.ljust(width)}  {'':<13} {elapsed:7.2f}s")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the label and dispatch scripts, skipping anything already up to date.")
+    parser.add_argument(
+        "--dir",
+        default=os.getcwd(),
+        help="Folder with the exports and outputs (default: current folder)"
+    )
+    parser.add_argument(
+        "--warehouse",
+        choices=["1", "2"],
+        default=None,
+        help="Also create labels with createLabels.py for this warehouse"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=None,
+        help="Sendle quote threshold passed to createLabels.py"
+    )
+    parser.add_argument(
+        "--grid",
+        default=None,
+        help="Basic labels per page passed to createLabels.py, eg. 2x2"
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=4,
+        help="Stages that may run at the same time (default: 4)"
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Run every stage even if its outputs are up to date"
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="Show the output of every stage, not just failed ones"
+    )
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    results = run_pipeline(build_stages(args.warehouse, args.threshold, args.grid), args.dir, args.jobs, args.force, args.verbose)
+    print_summary(results, time.perf_counter() - started)
+
+    if any(status in ('failed', 'blocked') for status, _ in results.values()):
+        sys.exit(1)
@@ -0,0 +1,417 @@
+import argparse
+import contextlib
+import csv
+import difflib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+REGRESSION_DIR = os.path.join(BASE_DIR, 'regression')
+# The golden files were made by running the scripts as they were before any performance
+# work (the repo's first commit) on these fixtures, so they show that output is unchanged
+GOLDEN_DIR = os.path.join(REGRESSION_DIR, 'golden')
+# Timings depend on the computer, so baselines are recorded locally and not committed
+BASELINES_PATH = os.path.join(REGRESSION_DIR, 'baselines.json')
+RESULTS_PATH = os.path.join(REGRESSION_DIR, 'results.json')
+
+SEED = 7
+ORDERS = 400                        # orders per platform in the fixture exports (Catch gets half)
+DISPATCH_DATE = datetime(2025, 1, 6)
+TIME_TOLERANCE = 0.25               # a stage may be this much slower than its baseline
+MEMORY_TOLERANCE = 0.25             # and use this much more memory at its peak
+TIME_SLACK = 0.05                   # seconds on top, so very quick stages do not fail on timer noise
+
+# Stage name -> files it writes, compared byte for byte with regression/golden/
+STAGE_OUTPUTS = {
+    'standardize': ['standardized_columns.csv'],
+    'merge': ['merged_labels.csv'],
+    'annotate': ['annotated_labels.csv'],
+    'dispatch': ['koganDispatch.csv', 'eBayDispatch.csv'],
+}
+
+# =========================
+# seeded fixtures
+# =========================
+
+ENVELOPES = ['Small', 'C5', 'C4', 'Parcel', 'Parcel-Medium', 'TMP-C5', 'Weird']
+STREETS = ['Smith St', 'Smith Street', 'High Rd', 'Main Road', 'Unit 3 12 King St', '3/12 King St']
+NAMES = ['Ann Lee', 'Bob Ray', 'Cy Tan', 'Di Wu', 'Ed Ko', 'Flo Ng']
+
+
+def read_codes(filename):
+    with open(os.path.join(BASE_DIR, filename), newline='') as f:
+        return [row[0] for row in list(csv.reader(f))[1:] if row]
+
+
+def write_csv(path, header, rows, before=(), after=()):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerows(before)
+        writer.writerow(header)
+        writer.writerows(rows)
+        writer.writerows(after)
+
+
+def write_fixtures(directory, seed=SEED, orders=ORDERS):
+    """
+    Writes Shopify, eBay, Kogan and Catch exports and a tracking.csv made up from a seeded
+    random generator, so every run sees exactly the same orders. They cover the awkward
+    cases of real exports: missing shipping details, multi-line eBay orders with a summary
+    row, NEX-/brand prefixed Kogan codes, x2 multipliers, unknown envelopes and tracking
+    numbers mangled into scientific notation by Excel.
+    """
+    rng = random.Random(seed)
+    phones = read_codes('PhoneModelMSDB.csv')
+    cables = read_codes('cables.csv')
+
+    def sku():
+        code = rng.choice(phones) if rng.random() < .6 else rng.choice(cables)
+        if rng.random() < .08:
+            return code  # no envelope
+        label = f'[{rng.choice(ENVELOPES)}]{code}'
+        if rng.random() < .2:
+            label += f' x{rng.randint(2, 3)}'
+        return label
+
+    def address():
+        return f'{rng.randint(1, 9)} {rng.choice(STREETS)}'
+
+    # shopify
+    rows = []
+    for i in range(orders):
+        order_id = f'#SP{1000 + i}'
+        street, name = address(), rng.choice(NAMES)
+        postcode = f"'{3000 + int(street.split()[0])}"
+        for line in range(rng.choice([1, 1, 2])):
+            if line == 0:
+                shipped = rng.random() > .1
+                rows.append([order_id, name if shipped else '', 'BCo', street, 'Pakenham', "'3810", 'VIC', name,
+                             street if shipped else '', street, '', '', 'Pakenham' if shipped else '',
+                             postcode if shipped else '', 'VIC' if shipped else '',
+                             rng.choice(['', 'Kogan', 'mydeal, x', 'web']), sku(), rng.randint(1, 3), 'Std', '', '',
+                             f'{rng.uniform(5, 50):.2f}', 'x', 'y'])
+            else:
+                rows.append([order_id] + [''] * 15 + [sku(), 1, '', '', '', '', '', ''])
+    write_csv(os.path.join(directory, 'shopify_orders.csv'),
+              ['Name', 'Shipping Name', 'Billing Company', 'Billing Street', 'Billing City', 'Billing Zip',
+               'Billing Province', 'Billing Name', 'Shipping Street', 'Shipping Address 1', 'Shipping Address 2',
+               'Shipping Company', 'Shipping City', 'Shipping Zip', 'Shipping Province', 'Tags', 'Lineitem sku',
+               'Lineitem quantity', 'Shipping Method', 'Notes', 'Notes Attribute', 'Total', 'Extra A', 'Extra B'],
+              rows)
+
+    # ebay
+    header = ['Sales Record Number', 'Order Number', 'Buyer Username', 'Buyer Name', 'Item Number', 'Item Title',
+              'Custom Label', 'Quantity', 'Sold For', 'Postage Service', 'Post To Name', 'Post To Address 1',
+              'Post To Address 2', 'Post To City', 'Post To State', 'Post To Postal Code', 'Transaction ID', 'Extra']
+    rows = []
+    ebay_ids = []
+    for i in range(orders):
+        order_id = f'{rng.randint(10, 99)}-{rng.randint(10000, 99999)}-{rng.randint(10000, 99999)}'
+        ebay_ids.append(order_id)
+        street, name = address(), rng.choice(NAMES)
+        postcode = str(3000 + int(street.split()[0]))
+        service = rng.choice(['Untracked Post', 'Tracked Post', 'Express Post', 'Standard'])
+        address1 = rng.choice([street, 'ebay:abc123'])
+        address2 = street if address1.startswith('ebay') else ''
+        lines = rng.choice([1, 1, 3])
+        if lines == 1:
+            rows.append([i, order_id, 'u', name, rng.randint(1, 9 ** 9), 'Title', sku(), rng.randint(1, 2),
+                         f'AU ${rng.uniform(3, 40):.2f}', service, name, address1, address2, 'Melbourne', 'VIC',
+                         postcode, f'T{i}', ''])
+        else:
+            # Summary row with the order total, then one row per item
+            rows.append([i, order_id, 'u', name, '', '', '', str(lines - 1), 'AU $60.00', service, name, address1,
+                         address2, 'Melbourne', 'VIC', postcode, '', ''])
+            for line in range(lines - 1):
+                rows.append([i, order_id, 'u', '', rng.randint(1, 9 ** 9), 'Title', sku(), 1, 'AU $20.00', '', '',
+                             '', '', '', '', '', f'T{i}{line}', ''])
+    blank = [[''] * len(header)]
+    write_csv(os.path.join(directory, 'eBay_orders.csv'), header, blank + rows,
+              before=blank, after=[[f'{len(rows)} record(s) downloaded'] + [''] * (len(header) - 1)])
+
+    # kogan
+    rows = []
+    kogan_ids = []
+    for i in range(orders):
+        order_id = ''.join(rng.choice('ABCDEFGH0123456789') for _ in range(8))
+        kogan_ids.append(order_id)
+        street, name = address(), rng.choice(NAMES)
+        for line in range(rng.choice([1, 1, 2])):
+            code = sku().replace('[', rng.choice(['[', '[KG-', '[USAMS-', '[UB-']), 1)
+            rows.append([order_id, order_id, name, street, rng.choice(['', 'Apt 2']), 'Clayton', 'VIC',
+                         3000 + int(street.split()[0]), rng.randint(1, 2), rng.choice(['', 'NEX-']) + code,
+                         f'{rng.uniform(5, 40):.2f}', 'm'])
+    write_csv(os.path.join(directory, 'kogan_orders.csv'),
+              ['OrderID', 'LabelInfo', 'DeliveryName', 'DeliveryAddress1', 'DeliveryAddress2', 'DeliverySuburb',
+               'DeliveryState', 'DeliveryPostcode', 'Quantity', 'ProductCode', 'ItemPrice', 'Misc'],
+              rows)
+
+    # catch
+    rows = []
+    for i in range(orders // 2):
+        street, (first, last) = address(), rng.choice(NAMES).split()
+        rows.append([f'C{5000 + i}-A', rng.randint(1, 2), sku(), 'Standard', first, last, rng.choice(['', 'Acme']),
+                     street, '', 'Box Hill', 'VIC', 3000 + int(street.split()[0]), f'{rng.uniform(5, 40):.2f}', ''])
+    write_csv(os.path.join(directory, 'Catch_orders.csv'),
+              ['Order Number', 'Quantity', 'Offer SKU', 'Shipping Method', 'Shipping Address First Name',
+               'Shipping Address Last Name', 'Shipping Address Company', 'Shipping Address Street 1',
+               'Shipping Address Street 2', 'Shipping Address City', 'Shipping Address State', 'Shipping Address Zip',
+               'Total Order Amount Incl. VAT (including shipping charges)', 'Other'],
+              rows)
+
+    # tracking, for half the Kogan orders and a third of the eBay ones
+    rows = [[order_id, rng.choice(['ABC1234', '3.3E+22', "'TMP123456789", 'ELMS'])] for order_id in kogan_ids[::2]]
+    rows += [[order_id, rng.choice(['XYZ98765432', '1.2E+15', 'none'])] for order_id in ebay_ids[::3]]
+    write_csv(os.path.join(directory, 'tracking.csv'), ['ID', 'Tracking Number'], rows)
+
+# =========================
+# stages
+# =========================
+
+def load_scripts():
+    """
+    Imports the scripts from the project folder, where merge.py finds PhoneModelMSDB.csv
+    and cables.csv when it is imported.
+    """
+    os.chdir(BASE_DIR)
+    global read_and_standardize, write_standardized, merge_orders, finishUpLabel, annotate_phone_model, run_dispatch
+    from generateLabels import read_and_standardize, write_standardized
+    from merge import merge_orders, finishUpLabel, annotate_phone_model
+    from dispatch import run_dispatch
+
+
+def run_standardize(work_dir):
+    write_standardized(read_and_standardize(work_dir), os.path.join(work_dir, 'standardized_columns.csv'))
+
+
+def run_merge(work_dir):
+    merge_orders(os.path.join(work_dir, 'standardized_columns.csv'), os.path.join(work_dir, 'merged_labels.csv'))
+
+
+def run_annotate(work_dir):
+    # Every standardized label on its own, one annotate_phone_model call per row
+    with open(os.path.join(work_dir, 'standardized_columns.csv'), newline='') as f:
+        labels = [row['custom_label'] for row in csv.DictReader(f)]
+    with open(os.path.join(work_dir, 'annotated_labels.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['custom_label'])
+        writer.writerows([annotate_phone_model(finishUpLabel(label))] for label in labels)
+
+
+def run_dispatch_files(work_dir):
+    run_dispatch(work_dir, dispatch_date=DISPATCH_DATE)
+
+
+STAGES = {
+    'standardize': run_standardize,
+    'merge': run_merge,
+    'annotate': run_annotate,
+    'dispatch': run_dispatch_files,
+}
+
+
+def measure(stage, work_dir, repeat):
+    """
+    Runs the stage repeat times and once more under tracemalloc.
+
+    Returns:
+        tuple: (fastest seconds, peak Python memory in MB)
+    """
+    timings = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            started = time.perf_counter()
+            stage(work_dir)
+            timings.append(time.perf_counter() - started)
+
+        tracemalloc.start()
+        try:
+            stage(work_dir)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return min(timings), peak / 1024 / 1024
+
+# =========================
+# checks
+# =========================
+
+def compare_output(work_dir, filename):
+    """
+    Compares a stage output with its golden file. Returns None when identical, else a short diff.
+    """
+    golden = os.path.join(GOLDEN_DIR, filename)
+    if not os.path.exists(golden):
+        return f"no golden file {os.path.relpath(golden, BASE_DIR)}, run with --update-golden"
+    output = os.path.join(work_dir, filename)
+    if not os.path.exists(output):
+        return "not written"
+
+    with open(golden, 'rb') as f:
+        expected = f.read()
+    with open(output, 'rb') as f:
+        actual = f.read()
+    if expected == actual:
+        return None
+
+    diff = difflib.unified_diff(
+        expected.decode('utf-8', 'replace').splitlines(), actual.decode('utf-8', 'replace').splitlines(),
+        'golden/' + filename, filename, lineterm='', n=0
+    )
+    return '\n'.join(list(diff)[:12])
+
+
+def load_baselines(path=BASELINES_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f).get('stages', {})
+
+
+def check_stage(result, baseline, time_tolerance, memory_tolerance):
+    """
+    Adds the baseline figures to a stage's result and returns its problems, if any.
+    """
+    problems = []
+    if result['diffs']:
+        problems.append('output differs from golden')
+    if baseline:
+        allowed_seconds = baseline['seconds'] * (1 + time_tolerance) + TIME_SLACK
+        allowed_mb = baseline['peak_mb'] * (1 + memory_tolerance)
+        result['baseline_seconds'] = baseline['seconds']
+        result['baseline_peak_mb'] = baseline['peak_mb']
+        if result['seconds'] > allowed_seconds:
+            problems.append(f"{result['seconds']:.3f}s is slower than the {baseline['seconds']:.3f}s baseline")
+        if result['peak_mb'] > allowed_mb:
+            problems.append(f"{result['peak_mb']:.1f} MB is more than the {baseline['peak_mb']:.1f} MB baseline")
+    return problems
+
+
+def environment():
+    return {'python': platform.python_version(), 'machine': platform.machine(), 'system': platform.system()}
+
+
+def run_regression(repeat=5, time_tolerance=TIME_TOLERANCE, memory_tolerance=MEMORY_TOLERANCE,
+                   update_golden=False, update_baselines=False, keep=False):
+    """
+    Runs every stage on the seeded fixtures, checks the outputs against regression/golden/
+    and the timings against regression/baselines.json, and saves regression/results.json.
+    With update_golden the golden files, and with update_baselines the baselines, are
+    replaced by this run's instead of checked. Baselines only mean something on the
+    computer they were recorded on, so they are kept out of git.
+
+    Returns:
+        bool: True when every output matched and no stage regressed.
+    """
+    load_scripts()
+    baselines = {} if update_baselines else load_baselines()
+    work_dir = tempfile.mkdtemp(prefix='regression_')
+    results = {}
+    failed = False
+
+    try:
+        write_fixtures(work_dir)
+        for name, stage in STAGES.items():
+            seconds, peak_mb = measure(stage, work_dir, repeat)
+            result = {'seconds': round(seconds, 4), 'peak_mb': round(peak_mb, 2), 'diffs': {}}
+            if not update_golden:
+                for filename in STAGE_OUTPUTS[name]:
+                    diff = compare_output(work_dir, filename)
+                    if diff:
+                        result['diffs'][filename] = diff
+
+            problems = check_stage(result, baselines.get(name), time_tolerance, memory_tolerance)
+            result['status'] = 'failed' if problems else 'ok'
+            failed = failed or bool(problems)
+            results[name] = result
+
+            baseline = f" (baseline {result['baseline_seconds']:.3f}s, {result['baseline_peak_mb']:.1f} MB)" \
+                if 'baseline_seconds' in result else ''
+            print(f"{name:<12} {result['status']:<7} {seconds:8.3f}s {peak_mb:8.1f} MB{baseline}")
+            for problem in problems:
+                print(f"    {problem}")
+            for filename, diff in result['diffs'].items():
+                print(f"    {filename}:\n" + '\n'.join('      ' + line for line in diff.splitlines()))
+
+        if update_golden:
+            os.makedirs(GOLDEN_DIR, exist_ok=True)
+            for filename in (f for outputs in STAGE_OUTPUTS.values() for f in outputs):
+                shutil.copyfile(os.path.join(work_dir, filename), os.path.join(GOLDEN_DIR, filename))
+            print(f"Golden files updated in {os.path.relpath(GOLDEN_DIR, BASE_DIR)}/")
+        if update_baselines:
+            with open(BASELINES_PATH, 'w') as f:
+                json.dump({
+                    'recorded': datetime.now().isoformat(timespec='seconds'),
+                    **environment(),
+                    'stages': {name: {'seconds': r['seconds'], 'peak_mb': r['peak_mb']} for name, r in results.items()},
+                }, f, indent=2)
+            print(f"Baselines for this computer saved to {os.path.relpath(BASELINES_PATH, BASE_DIR)}")
+        elif not baselines:
+            print("No baselines recorded on this computer yet, run with --update-baselines to record them.")
+    finally:
+        if keep:
+            print(f"Fixtures and outputs kept in {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(RESULTS_PATH, 'w') as f:
+        json.dump({
+            'run': datetime.now().isoformat(timespec='seconds'),
+            **environment(),
+            'time_tolerance': time_tolerance,
+            'memory_tolerance': memory_tolerance,
+            'stages': results,
+        }, f, indent=2)
+    return not failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check the scripts' outputs and speed against stored golden files and baselines.")
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=5,
+        help="Timed runs per stage, the fastest one counts (default: 5)"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=TIME_TOLERANCE,
+        help=f"How much slower than its baseline a stage may be, as a fraction (default: {TIME_TOLERANCE})"
+    )
+    parser.add_argument(
+        "--memory-tolerance",
+        type=float,
+        default=MEMORY_TOLERANCE,
+        help=f"How much more peak memory than its baseline a stage may use, as a fraction (default: {MEMORY_TOLERANCE})"
+    )
+    parser.add_argument(
+        "--update-golden",
+        action="store_true",
+        help="Replace the golden files with this run's outputs, only after an intended output change"
+    )
+    parser.add_argument(
+        "--update-baselines",
+        action="store_true",
+        help="Record this run's timings and memory as this computer's baselines"
+    )
+    parser.add_argument(
+        "--keep",
+        action="store_true",
+        help="Keep the generated fixtures and outputs for inspection"
+    )
+    args = parser.parse_args()
+
+    ok = run_regression(max(1, args.repeat), args.tolerance, args.memory_tolerance,
+                        args.update_golden, args.update_baselines, args.keep)
+    print(f"Results saved to: {os.path.relpath(RESULTS_PATH, BASE_DIR)}")
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,322 @@
+import argparse
+import sqlite3
+from datetime import datetime
+
+import pandas as pd
+
+DEFAULT_DB = 'orders.db'
+
+# =========================
+# schema
+# =========================
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    id TEXT NOT NULL,
+    line INTEGER NOT NULL,
+    source_platform TEXT,
+    rname TEXT,
+    address TEXT,
+    city TEXT,
+    state TEXT,
+    zip TEXT,
+    shipping_method TEXT,
+    custom_label TEXT,
+    Quantity REAL,
+    amt REAL,
+    updated_at TEXT,
+    PRIMARY KEY (id, line)
+);
+CREATE INDEX IF NOT EXISTS orders_by_address ON orders (address, rname);
+
+CREATE TABLE IF NOT EXISTS merged_labels (
+    label_id INTEGER PRIMARY KEY,
+    ids TEXT NOT NULL UNIQUE,
+    rname TEXT,
+    address TEXT,
+    city TEXT,
+    state TEXT,
+    zip TEXT,
+    custom_label TEXT,
+    sort TEXT,
+    amt REAL,
+    updated_at TEXT
+);
+
+-- one row per order id inside a (possibly combined) merged label
+CREATE TABLE IF NOT EXISTS label_orders (
+    order_id TEXT PRIMARY KEY,
+    label_id INTEGER NOT NULL REFERENCES merged_labels (label_id)
+);
+CREATE INDEX IF NOT EXISTS label_orders_by_label ON label_orders (label_id);
+
+CREATE TABLE IF NOT EXISTS tracking (
+    order_id TEXT PRIMARY KEY,
+    tracking_number TEXT NOT NULL,
+    updated_at TEXT
+);
+
+-- tracking.csv files already upserted, so an unchanged file is not read again
+CREATE TABLE IF NOT EXISTS tracking_files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    imported_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS sendle_refs (
+    order_id TEXT PRIMARY KEY,
+    sendle_reference TEXT NOT NULL,
+    tracking_url TEXT,
+    created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS sendle_refs_by_reference ON sendle_refs (sendle_reference);
+"""
+
+ORDER_COLUMNS = ['source_platform', 'rname', 'address', 'city', 'state', 'zip',
+                 'shipping_method', 'custom_label', 'Quantity', 'amt']
+LABEL_COLUMNS = ['rname', 'address', 'city', 'state', 'zip', 'custom_label', 'sort', 'amt']
+
+
+def open_store(path=DEFAULT_DB):
+    """
+    Opens (and creates if needed) the SQLite order store.
+    """
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _now():
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def _records(df, columns):
+    """
+    Rows of df as tuples with missing values as None, ready for executemany.
+    """
+    df = df.reindex(columns=columns).astype(object)
+    return list(df.where(df.notna(), None).itertuples(index=False, name=None))
+
+
+def _split_ids(ids):
+    return [i.strip() for i in str(ids).split(',') if i.strip()]
+
+
+def _fill_wanted(conn, values):
+    """
+    Loads values into the temp table "wanted", to join lookups against.
+    """
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS wanted (key TEXT PRIMARY KEY)')
+    conn.execute('DELETE FROM wanted')
+    conn.executemany('INSERT OR IGNORE INTO wanted VALUES (?)', [(v,) for v in values])
+
+# =========================
+# upserts
+# =========================
+
+def upsert_orders(conn, df):
+    """
+    Stores standardized orders. Every id in df replaces whatever the store had for it,
+    so re-ingesting an export never leaves stale lines behind.
+
+    Parameters:
+        conn: connection from open_store
+        df (pd.DataFrame): standardized_columns.csv rows
+    """
+    df = df.copy()
+    df['id'] = df['id'].astype(str).str.strip()
+    df['line'] = df.groupby('id', sort=False).cumcount()
+    if 'zip' in df.columns:
+        df['zip'] = df['zip'].astype('string').str.zfill(4)
+    df['updated_at'] = _now()
+
+    columns = ['id', 'line'] + ORDER_COLUMNS + ['updated_at']
+    with conn:
+        conn.executemany('DELETE FROM orders WHERE id = ?', [(i,) for i in df['id'].unique()])
+        conn.executemany(
+            f"INSERT INTO orders ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+            _records(df, columns)
+        )
+    return len(df)
+
+
+def upsert_merged_labels(conn, df):
+    """
+    Stores merged labels and maps every order id in a combined label to it. A stored label
+    that one of these orders was on before, with a different set of ids, was superseded by
+    a re-merge and is removed together with its order mappings.
+
+    Parameters:
+        conn: connection from open_store
+        df (pd.DataFrame): merged_labels.csv rows
+    """
+    df = df.copy()
+    df['id'] = df['id'].astype(str).str.strip()
+    if 'zip' in df.columns:
+        df['zip'] = df['zip'].astype('string').str.zfill(4)
+    df['updated_at'] = _now()
+
+    columns = ['id'] + LABEL_COLUMNS + ['updated_at']
+    updates = ', '.join(f'{c} = excluded.{c}' for c in LABEL_COLUMNS + ['updated_at'])
+    with conn:
+        _fill_wanted(conn, [order_id for ids in df['id'] for order_id in _split_ids(ids)])
+        new_ids = set(df['id'])
+        superseded = [(label_id,) for label_id, ids in conn.execute(
+            'SELECT DISTINCT m.label_id, m.ids FROM wanted w JOIN label_orders l ON l.order_id = w.key '
+            'JOIN merged_labels m ON m.label_id = l.label_id'
+        ) if ids not in new_ids]
+        conn.executemany('DELETE FROM label_orders WHERE label_id = ?', superseded)
+        conn.executemany('DELETE FROM merged_labels WHERE label_id = ?', superseded)
+
+        conn.executemany(
+            f"INSERT INTO merged_labels (ids, {', '.join(columns[1:])}) VALUES ({', '.join('?' * len(columns))}) "
+            f"ON CONFLICT (ids) DO UPDATE SET {updates}",
+            _records(df, columns)
+        )
+        # Looked up by the ids just written, other runs may have written labels in the same second
+        _fill_wanted(conn, df['id'])
+        label_ids = dict(conn.execute(
+            'SELECT m.ids, m.label_id FROM wanted w JOIN merged_labels m ON m.ids = w.key'
+        ).fetchall())
+        conn.executemany(
+            'INSERT INTO label_orders (order_id, label_id) VALUES (?, ?) '
+            'ON CONFLICT (order_id) DO UPDATE SET label_id = excluded.label_id',
+            [(order_id, label_ids[ids]) for ids in df['id'] for order_id in _split_ids(ids)]
+        )
+    return len(df)
+
+
+def upsert_tracking(conn, tracking_df):
+    """
+    Stores tracking numbers by order id. A later row for the same order replaces an earlier one,
+    rows the store already has unchanged are left alone.
+
+    Parameters:
+        conn: connection from open_store
+        tracking_df (pd.DataFrame): 'ID' and 'Tracking Number' columns, already normalized
+
+    Returns:
+        int: Number of tracking numbers added or changed.
+    """
+    tracking_df = tracking_df[tracking_df['Tracking Number'].fillna('') != '']
+    rows = [(i, t, _now()) for i, t in zip(tracking_df['ID'], tracking_df['Tracking Number'])]
+    changes = conn.total_changes
+    with conn:
+        conn.executemany(
+            'INSERT INTO tracking (order_id, tracking_number, updated_at) VALUES (?, ?, ?) '
+            'ON CONFLICT (order_id) DO UPDATE SET tracking_number = excluded.tracking_number, '
+            'updated_at = excluded.updated_at WHERE tracking_number IS NOT excluded.tracking_number',
+            rows
+        )
+    return conn.total_changes - changes
+
+
+def tracking_file_changed(conn, path, stat):
+    """
+    Whether this tracking.csv (by path, size and modification time) has not been upserted yet.
+    """
+    row = conn.execute('SELECT size, mtime_ns FROM tracking_files WHERE path = ?', (path,)).fetchone()
+    return row is None or (row['size'], row['mtime_ns']) != (stat.st_size, stat.st_mtime_ns)
+
+
+def mark_tracking_file(conn, path, stat):
+    """
+    Remembers that this version of a tracking.csv has been upserted.
+    """
+    with conn:
+        conn.execute(
+            'INSERT INTO tracking_files (path, size, mtime_ns, imported_at) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (path) DO UPDATE SET size = excluded.size, mtime_ns = excluded.mtime_ns, '
+            'imported_at = excluded.imported_at',
+            (path, stat.st_size, stat.st_mtime_ns, _now())
+        )
+
+
+def record_sendle_ref(conn, order_id, sendle_reference, tracking_url=None):
+    """
+    Remembers the Sendle reference created for an order (or combined order ids).
+    """
+    with conn:
+        conn.executemany(
+            'INSERT INTO sendle_refs (order_id, sendle_reference, tracking_url, created_at) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (order_id) DO UPDATE SET sendle_reference = excluded.sendle_reference, '
+            'tracking_url = excluded.tracking_url, created_at = excluded.created_at',
+            [(i, sendle_reference, tracking_url, _now()) for i in _split_ids(order_id)]
+        )
+
+# =========================
+# lookups
+# =========================
+
+def tracking_for(conn, order_ids):
+    """
+    Indexed lookup of tracking numbers for the given order ids.
+
+    Returns:
+        pd.DataFrame: 'ID' and 'Tracking Number' columns, one row per order found.
+    """
+    with conn:
+        _fill_wanted(conn, order_ids)
+    rows = conn.execute(
+        'SELECT t.order_id, t.tracking_number FROM wanted w JOIN tracking t ON t.order_id = w.key'
+    ).fetchall()
+    return pd.DataFrame([tuple(r) for r in rows], columns=['ID', 'Tracking Number'], dtype=str)
+
+
+def find(conn, order_id):
+    """
+    Everything the store knows about one order: its order lines, the merged label it went
+    out on (with the other orders on that label), its tracking number and Sendle reference.
+    """
+    order_id = order_id.strip()
+    label = conn.execute(
+        'SELECT m.* FROM label_orders l JOIN merged_labels m ON m.label_id = l.label_id WHERE l.order_id = ?',
+        (order_id,)
+    ).fetchone()
+    tracking = conn.execute('SELECT * FROM tracking WHERE order_id = ?', (order_id,)).fetchone()
+    sendle = conn.execute('SELECT * FROM sendle_refs WHERE order_id = ?', (order_id,)).fetchone()
+    return {
+        'orders': [dict(r) for r in conn.execute('SELECT * FROM orders WHERE id = ? ORDER BY line', (order_id,))],
+        'label': dict(label) if label else None,
+        'tracking': dict(tracking) if tracking else None,
+        'sendle': dict(sendle) if sendle else None,
+    }
+
+
+def print_found(order_id, found):
+    if not any(found.values()):
+        print(f"{order_id}: not in the store")
+        return
+
+    print(f"Order {order_id}")
+    for line in found['orders']:
+        print(f"  [{line['source_platform']}] {line['custom_label']} x{line['Quantity']} "
+              f"→ {line['rname']}, {line['address']}, {line['city']} {line['state']} {line['zip']}")
+    if found['label']:
+        print(f"  label: {found['label']['custom_label']} (orders {found['label']['ids']})")
+    if found['tracking']:
+        print(f"  tracking: {found['tracking']['tracking_number']}")
+    if found['sendle']:
+        print(f"  sendle: {found['sendle']['sendle_reference']} {found['sendle']['tracking_url'] or ''}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Look up orders in the local order store.")
+    parser.add_argument(
+        "order_ids",
+        nargs='+',
+        help="Order ids to look up"
+    )
+    parser.add_argument(
+        "--db",
+        default=DEFAULT_DB,
+        help=f"Path of the SQLite store (default: {DEFAULT_DB})"
+    )
+    args = parser.parse_args()
+
+    conn = open_store(args.db)
+    for order_id in args.order_ids:
+        print_found(order_id, find(conn, order_id))
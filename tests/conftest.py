@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The scripts import from the project folder and merge.py reads PhoneModelMSDB.csv and
+# cables.csv from the current folder when it is imported
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(PROJECT_DIR)
+sys.path.insert(0, PROJECT_DIR)
@@ -0,0 +1,102 @@
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+from PyPDF2 import PdfReader
+from reportlab.lib.pagesizes import A4, A6
+
+
+@pytest.fixture(scope='module')
+def createLabels(tmp_path_factory):
+    # createLabels.py reads the Sendle keys when it is imported, the drawing needs none
+    secrets = tmp_path_factory.mktemp('secrets') / 'secrets.json'
+    secrets.write_text(json.dumps({'SENDLE_ID': 'test', 'API_KEY': 'test'}))
+    os.environ['LABELS_SECRETS'] = str(secrets)
+    import createLabels
+    yield createLabels
+    os.environ.pop('LABELS_SECRETS')
+    sys.modules.pop('createLabels')
+
+
+def basic_run(directory, rows, part_pages=200):
+    basic_csv = directory / 'basic_labels.csv'
+    pd.DataFrame({
+        'receiver_name': [f'Receiver {i}' for i in range(rows)],
+        'receiver_address_line1': '12 Smith St',
+        'receiver_suburb': 'Clayton',
+        'receiver_state_name': 'VIC',
+        'receiver_postcode': 3168,
+        'customer_reference': [f'REF{i}' for i in range(rows)],
+        'description': [f'ID{i}' for i in range(rows)],
+    }).to_csv(basic_csv, index=False)
+    return SimpleNamespace(basic_csv=str(basic_csv), basic_pdf=str(directory / 'basic.pdf'), part_pages=part_pages,
+                           split_pdf=False, config={'label_sender_block': 'Sender\n1 Sender St'})
+
+
+def receiver_positions(page):
+    """Where each 'Receiver n' line starts on the page."""
+    positions = {}
+
+    def visit(text, cm, tm, font, size):
+        if text.startswith('Receiver '):
+            positions[text.strip()] = (cm[4], cm[5])
+    page.extract_text(visitor_text=visit)
+    return positions
+
+
+def test_single_label_keeps_its_spot(createLabels):
+    page_w, page_h = A4
+    assert createLabels.label_origins() == [(20, page_h - A6[1] - 20)]
+
+
+def test_grid_origins_are_the_page_quarters(createLabels):
+    page_w, page_h = A4
+    assert createLabels.label_origins((2, 2)) == [
+        (0, page_h / 2), (page_w / 2, page_h / 2), (0, 0), (page_w / 2, 0),
+    ]
+
+
+def test_2x2_sheet(createLabels, tmp_path):
+    # 10 labels, 4 a page, 2 pages a part: 3 pages joined from 2 parts
+    run = basic_run(tmp_path, 10, part_pages=2)
+    createLabels.draw_basic_labels(run, grid=(2, 2))
+
+    pages = PdfReader(run.basic_pdf).pages
+    assert len(pages) == 3
+
+    slots = createLabels.label_origins((2, 2))
+    label_w, label_h = A6
+    for number, page in enumerate(pages):
+        positions = receiver_positions(page)
+        expected = range(number * 4, min(number * 4 + 4, 10))
+        assert sorted(positions) == sorted(f'Receiver {i}' for i in expected)
+        for slot, i in enumerate(expected):
+            x, y = positions[f'Receiver {i}']
+            slot_x, slot_y = slots[slot]
+            assert slot_x <= x <= slot_x + label_w and slot_y <= y <= slot_y + label_h
+
+
+def test_booked_order_without_a_label_keeps_its_tracking(createLabels, tmp_path, monkeypatch, capsys):
+    run = basic_run(tmp_path, 2)
+    run.csv_filename = run.basic_csv
+    run.basic_csv = str(tmp_path / 'basic_out.csv')
+    run.tracking_csv = str(tmp_path / 'tracking_update.csv')
+    run.sendle_dir = str(tmp_path / 'sendles')
+    run.sp, run.sd = [['Basic']], [['Sendle']]
+
+    def create_sendle_order(row, config):
+        if row['customer_reference'] == 'REF1':
+            return {'error': 'unprocessable_entity'}
+        return {'sendle_reference': 'S0', 'tracking_url': 't/S0', 'order_url': 'o/S0', 'labels': None}
+
+    monkeypatch.setattr(createLabels, 'quote_price_for', lambda row, config: 3.0)
+    monkeypatch.setattr(createLabels, 'create_sendle_order', create_sendle_order)
+    monkeypatch.setattr(createLabels, 'wait_for_label_url', lambda order_url: None)
+    createLabels.create_sendle_labels(run, price_threshold=6.0)
+
+    assert run.sd[1:] == [['ID0', ' ', ' ', 'Receiver 0', 'S0', ' ', ' ', 't/S0']]
+    assert pd.read_csv(run.basic_csv)['description'].tolist() == ['ID1']
+    assert 'S0 (ID0)' in capsys.readouterr().out
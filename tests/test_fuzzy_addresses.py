@@ -0,0 +1,42 @@
+import pandas as pd
+import pytest
+
+from merge import canonical_address, cluster_similar, house_number, unify_addresses, FUZZY_ADDRESS_THRESHOLD
+
+
+def unified(*addresses):
+    df = pd.DataFrame({
+        'address': list(addresses),
+        'rname': 'Ann Lee',
+        'zip': '3000',
+        'source_platform': 'KG',
+    })
+    return unify_addresses(df)['address'].tolist()
+
+
+def test_street_suffix_spellings_are_merged():
+    assert unified('12 Smith St', '12 Smith Street', '12 Smith St') == ['12 Smith St'] * 3
+
+
+def test_unit_notations_are_merged():
+    assert unified('Unit 3, 12 Smith Street', '3/12 Smith St', '3/12 Smith St') == ['3/12 Smith St'] * 3
+
+
+@pytest.mark.parametrize('a, b', [
+    ('3/12 Smith St', '4/12 Smith St'),
+    ('12 Smith St Apt 3', '12 Smith St Apt 2'),
+    ('Unit 3 12 Smith St', 'Unit 4 12 Smith St'),
+    ('Shop 1 12 Smith St', 'Shop 2 12 Smith St'),
+    ('12a Smith St', '12 Smith St'),
+    ('12 Smith St', '12 Smith St Apt 2'),
+])
+def test_different_units_are_kept_apart(a, b):
+    assert house_number(canonical_address(a)) != house_number(canonical_address(b))
+    assert unified(a, b) == [a, b]
+
+
+def test_cluster_similar_does_not_see_across_units():
+    # The spellings alone are similar enough, it is the block key that keeps them apart
+    roots = cluster_similar(['3/12 smith st', '4/12 smith st'], FUZZY_ADDRESS_THRESHOLD)
+    assert roots['4/12 smith st'] == '3/12 smith st'
+    assert house_number('3/12 smith st') != house_number('4/12 smith st')
@@ -0,0 +1,47 @@
+import filecmp
+import pickle
+import warnings
+
+import pandas as pd
+
+import merge
+from regression import write_fixtures
+from generateLabels import read_and_standardize, write_standardized
+
+
+def standardized(tmp_path):
+    fixtures = tmp_path / 'fixtures'
+    fixtures.mkdir()
+    write_fixtures(str(fixtures), orders=60)
+    path = str(tmp_path / 'standardized_columns.csv')
+    write_standardized(read_and_standardize(str(fixtures)), path)
+    return path
+
+
+def test_rows_without_an_id_match_the_full_merge(tmp_path):
+    path = standardized(tmp_path)
+    df = pd.read_csv(path, dtype=str, keep_default_na=False)
+    df.loc[df.index[:3], 'id'] = ''
+    df.to_csv(path, index=False)
+
+    ledger = str(tmp_path / 'ledger.pkl')
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', RuntimeWarning)
+        merge.merge_orders_incremental(path, str(tmp_path / 'incremental.csv'), ledger)
+        merge.merge_orders_incremental(path, str(tmp_path / 'incremental.csv'), ledger)
+    merge.merge_orders(path, str(tmp_path / 'full.csv'))
+    assert filecmp.cmp(tmp_path / 'incremental.csv', tmp_path / 'full.csv', shallow=False)
+
+
+def test_ledger_of_other_code_or_lookups_is_not_reused(tmp_path, monkeypatch):
+    path = standardized(tmp_path)
+    ledger = str(tmp_path / 'ledger.pkl')
+    merge.merge_orders_incremental(path, str(tmp_path / 'merged.csv'), ledger)
+    assert merge.load_ledger(ledger) is not None
+
+    with open(ledger, 'rb') as f:
+        assert pickle.load(f)['version'] == merge.LEDGER_VERSION
+    assert merge.file_digest('cables.csv')[:16] in merge.LEDGER_VERSION
+    assert merge.file_digest('PhoneModelMSDB.csv')[:16] in merge.LEDGER_VERSION
+    monkeypatch.setattr(merge, 'LEDGER_VERSION', merge.LEDGER_VERSION + 'x')
+    assert merge.load_ledger(ledger) is None
@@ -0,0 +1,92 @@
+import json
+import os
+import threading
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import pandas as pd
+import pytest
+
+from generateLabels import read_and_standardize, write_standardized
+from label_service import LabelHandler, label_order
+from merge import merge_groups, prepare_orders, read_standardized
+from regression import write_fixtures
+
+ORDER_ID_COLUMNS = {'shopify': 'Name', 'ebay': 'Order Number', 'kogan': 'LabelInfo', 'catch': 'Order Number'}
+
+
+@pytest.fixture
+def service():
+    LabelHandler.quiet = True
+    server = ThreadingHTTPServer(('127.0.0.1', 0), LabelHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(scope='module')
+def fixture_orders(tmp_path_factory):
+    """The seeded fixture exports, and every order merged on its own by the batch path."""
+    directory = tmp_path_factory.mktemp('exports')
+    write_fixtures(str(directory), orders=150)
+    standardized_csv = str(directory / 'standardized_columns.csv')
+    write_standardized(read_and_standardize(str(directory)), standardized_csv)
+    prepared = prepare_orders(read_standardized(standardized_csv))
+    return directory, prepared
+
+
+def post_label(url, payload):
+    request = urllib.request.Request(
+        url + '/label', data=json.dumps(payload).encode('utf-8'), headers={'Content-Type': 'application/json'}
+    )
+    with urllib.request.urlopen(request) as response:
+        return response.status, json.loads(response.read())
+
+
+@pytest.mark.parametrize('platform, filename', [
+    ('shopify', 'shopify_orders.csv'),
+    ('ebay', 'eBay_orders.csv'),
+    ('kogan', 'kogan_orders.csv'),
+    ('catch', 'Catch_orders.csv'),
+])
+def test_matches_the_batch_path(fixture_orders, platform, filename):
+    directory, prepared = fixture_orders
+    export = pd.read_csv(os.path.join(directory, filename), dtype=str, keep_default_na=False,
+                         skiprows=[0, 2] if platform == 'ebay' else None)
+    by_id = dict(tuple(prepared.groupby('id', sort=False)))
+
+    compared = 0
+    for order_id, lines in export.groupby(ORDER_ID_COLUMNS[platform], sort=False):
+        if order_id.strip() not in by_id:
+            continue  # eBay's "record(s) downloaded" line
+        merged = merge_groups(by_id[order_id.strip()])
+        if len(merged) != 1:
+            continue  # lines going to different addresses are different parcels
+        result = label_order(platform, lines.to_dict('records'))
+        assert (result['label'], result['sort']) == (merged['custom_label'].iat[0], merged['sort'].iat[0]), order_id
+        assert result['amt'] == pytest.approx(merged['amt'].iat[0])
+        compared += 1
+    assert compared >= 50
+
+
+def test_empty_quantity_counts_as_one(service):
+    status, result = post_label(service, {
+        'platform': 'kogan',
+        'lines': [{'LabelInfo': 'ABC123', 'ProductCode': '[C5]A01-01-02', 'Quantity': '', 'ItemPrice': '7.78'}],
+    })
+    assert status == 200
+    assert result['label'] == '[KG]/[C5] A01-01-02*1'
+    assert result['amt'] == 7.78
+
+
+def test_missing_quantity_counts_as_one():
+    result = label_order('ebay', [{'Order Number': '12-34567-89012', 'Custom Label': '[C5]A01-01-02', 'Sold For': 'AU $5.00'}])
+    assert result['label'] == '[NG]/[C5] A01-01-02*1'
+    assert result['amt'] == 5.0
+
+
+def test_health(service):
+    with urllib.request.urlopen(service + '/health') as response:
+        assert json.loads(response.read()) == {'status': 'ok'}
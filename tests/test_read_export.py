@@ -0,0 +1,39 @@
+import pandas as pd
+import pytest
+
+import generateLabels
+from regression import write_fixtures
+
+
+@pytest.fixture(scope='module')
+def exports(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('exports')
+    write_fixtures(str(directory), orders=150)
+    return directory
+
+
+@pytest.mark.parametrize('filename, platform', [
+    ('shopify_orders.csv', 'shopify'),
+    ('kogan_orders.csv', 'kogan'),
+    ('Catch_orders.csv', 'catch'),
+    ('eBay_orders.csv', 'ebay'),
+])
+def test_blank_cells_stay_blank(exports, monkeypatch, filename, platform):
+    """process_file gives the same table as with the plain python parser as reference."""
+    path = str(exports / filename)
+    actual = generateLabels.process_file(path, platform)
+
+    read_csv = pd.read_csv
+    monkeypatch.setattr(generateLabels.pd, 'read_csv', lambda *args, **kwargs: read_csv(*args, **{**kwargs, 'engine': 'python'}))
+    expected = generateLabels.process_file(path, platform)
+
+    pd.testing.assert_frame_equal(actual, expected)
+    assert not actual.isin(['None', 'nan']).any().any()
+
+
+def test_pyarrow_str_cast_is_not_used(exports):
+    # pyarrow with dtype=str writes blank cells as "None"; read_export must not go that way
+    pytest.importorskip('pyarrow')
+    df = generateLabels.read_export(str(exports / 'kogan_orders.csv'), 'kogan')
+    assert df['DeliveryAddress2'].isna().any()
+    assert not df['DeliveryAddress2'].isin(['None', 'nan']).any()
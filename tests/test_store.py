@@ -0,0 +1,50 @@
+import pandas as pd
+
+from store import find, open_store, tracking_file_changed, mark_tracking_file, upsert_merged_labels, upsert_tracking
+
+
+def labels(*ids):
+    return pd.DataFrame({'id': list(ids), 'rname': 'Ann Lee', 'address': '12 Smith St', 'city': 'Clayton',
+                         'state': 'VIC', 'zip': '3168', 'custom_label': '[KG]/[C5] A01-01-02*1',
+                         'sort': 'A01-01-02*1', 'amt': 7.78})
+
+
+def test_labels_of_runs_in_the_same_second_stay_apart():
+    conn = open_store(':memory:')
+    upsert_merged_labels(conn, labels('A1, A2', 'B1'))
+    upsert_merged_labels(conn, labels('C1'))
+    assert find(conn, 'A2')['label']['ids'] == 'A1, A2'
+    assert find(conn, 'B1')['label']['ids'] == 'B1'
+    assert find(conn, 'C1')['label']['ids'] == 'C1'
+
+
+def test_unchanged_tracking_is_not_rewritten(tmp_path):
+    conn = open_store(':memory:')
+    tracking = pd.DataFrame({'ID': ['A1', 'B1'], 'Tracking Number': ['TMP1', 'TMP2']})
+    assert upsert_tracking(conn, tracking) == 2
+    assert upsert_tracking(conn, tracking) == 0
+    tracking.loc[1, 'Tracking Number'] = 'TMP3'
+    assert upsert_tracking(conn, tracking) == 1
+
+    path = tmp_path / 'tracking.csv'
+    path.write_text('ID,Tracking Number\nA1,TMP1\n')
+    assert tracking_file_changed(conn, str(path), path.stat())
+    mark_tracking_file(conn, str(path), path.stat())
+    assert not tracking_file_changed(conn, str(path), path.stat())
+    path.write_text('ID,Tracking Number\nA1,TMP1\nB1,TMP2\n')
+    assert tracking_file_changed(conn, str(path), path.stat())
+
+
+def test_re_merged_labels_replace_the_ones_they_supersede():
+    conn = open_store(':memory:')
+    upsert_merged_labels(conn, labels('A1', 'A2', 'B1'))
+    upsert_merged_labels(conn, labels('A1, A2'))
+    assert find(conn, 'A1')['label']['ids'] == 'A1, A2'
+    assert find(conn, 'A2')['label']['ids'] == 'A1, A2'
+    assert find(conn, 'B1')['label']['ids'] == 'B1'
+    assert [r['ids'] for r in conn.execute('SELECT ids FROM merged_labels ORDER BY ids')] == ['A1, A2', 'B1']
+
+    upsert_merged_labels(conn, labels('A1'))
+    assert find(conn, 'A1')['label']['ids'] == 'A1'
+    assert find(conn, 'A2')['label'] is None
+    assert conn.execute('SELECT COUNT(*) FROM label_orders WHERE order_id = ?', ('A2',)).fetchone()[0] == 0
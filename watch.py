@@ -0,0 +1,116 @@
+import argparse
+import os
+import time
+from datetime import datetime
+
+# Importing these loads pandas, PhoneModelMSDB.csv and cables.csv once for the whole session
+from generateLabels import read_and_standardize, write_standardized
+from merge import merge_orders
+
+STANDARDIZED_CSV = 'standardized_columns.csv'
+MERGED_CSV = 'merged_labels.csv'
+
+
+def log(message):
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] {message}", flush=True)
+
+
+def snapshot_exports(directory):
+    """
+    Returns {filename: (size, mtime)} for every export generateLabels.py would pick up.
+    """
+    exports = {}
+    for entry in os.scandir(directory):
+        if entry.is_file() and '_orders.csv' in entry.name.lower():
+            stat = entry.stat()
+            exports[entry.name] = (stat.st_size, stat.st_mtime_ns)
+    return exports
+
+
+def run_pipeline(directory, output_dir):
+    """
+    Runs the same steps as generateLabels.py followed by merge.py, using the warm modules.
+    """
+    started = time.perf_counter()
+    standardized_df = read_and_standardize(directory)
+    if standardized_df.empty:
+        log("No orders found in exports, skipping merge.")
+        return
+
+    standardized_csv = os.path.join(output_dir, STANDARDIZED_CSV)
+    merged_csv = os.path.join(output_dir, MERGED_CSV)
+    write_standardized(standardized_df, standardized_csv)
+    merge_orders(standardized_csv, merged_csv)
+    log(f"Labels ready in {time.perf_counter() - started:.2f}s")
+
+
+def watch(directory, output_dir, interval=1.0, settle=3.0, run_on_start=True):
+    """
+    Polls the directory and reruns the pipeline once the exports stop changing.
+
+    A change is only processed after every export has kept the same size and
+    modification time for `settle` seconds, so half-written downloads are not read.
+    """
+    processed = {} if run_on_start else snapshot_exports(directory)
+    pending = None
+    pending_since = 0.0
+
+    log(f"Watching {directory} for *_orders.csv (Ctrl+C to stop)")
+    while True:
+        current = snapshot_exports(directory)
+
+        if current != pending:
+            # Something is still being written, restart the settle timer
+            pending = current
+            pending_since = time.monotonic()
+        elif current != processed and time.monotonic() - pending_since >= settle:
+            changed = sorted(
+                name for name in current if processed.get(name) != current[name]
+            )
+            log(f"Detected new exports: {', '.join(changed) or 'removed files'}")
+            try:
+                run_pipeline(directory, output_dir)
+            except Exception as e:
+                log(f"Pipeline failed: {e}")
+            processed = current
+
+        time.sleep(interval)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Watch a folder and regenerate labels whenever order exports land.")
+    parser.add_argument(
+        "--dir",
+        default=os.getcwd(),
+        help="Folder the *_orders.csv exports are dropped into (default: current folder)"
+    )
+    parser.add_argument(
+        "--output-dir",
+        default=None,
+        help="Folder to write standardized_columns.csv and merged_labels.csv to (default: --dir)"
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=1.0,
+        help="Seconds between folder scans (default: 1.0)"
+    )
+    parser.add_argument(
+        "--settle",
+        type=float,
+        default=3.0,
+        help="Seconds an export must stay unchanged before it is processed (default: 3.0)"
+    )
+    parser.add_argument(
+        "--skip-existing",
+        action="store_true",
+        help="Do not process the exports already in the folder at startup"
+    )
+
+    args = parser.parse_args()
+    output_dir = args.output_dir or args.dir
+
+    try:
+        watch(args.dir, output_dir, args.interval, args.settle, run_on_start=not args.skip_existing)
+    except KeyboardInterrupt:
+        log("Stopped watching.")